@@ -1,10 +1,17 @@
 from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from typing import List
+from fastapi.responses import FileResponse, ORJSONResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 import uvicorn
+import aiofiles
+import asyncio
+import io
 import os
 import sys
+import tempfile
 import uuid
 from datetime import datetime
 from cryptography.fernet import Fernet
@@ -13,13 +20,28 @@ from cryptography.fernet import Fernet
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from services.classification import ClassificationService
+from services.key_pool import close_shared_clients
 from database.hitl_feedback import HITLDatabase
 from services.file_storage import SecureFileStorage
 from config.settings import Settings
 
 settings = Settings()
 
-app = FastAPI(title="Regulatory Document Classifier")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Audit rows are written off the request path by a background flusher
+    hitl_db.start_audit_flusher()
+    yield
+    await hitl_db.stop_audit_flusher()
+    storage_pool.shutdown(wait=True)
+    file_storage.close()
+    await close_shared_clients()
+
+app = FastAPI(
+    title="Regulatory Document Classifier",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # CORS
 app.add_middleware(
@@ -36,6 +58,11 @@ hitl_db = HITLDatabase(settings.DATABASE_PATH)
 # Initialize secure storage
 encryption_key = os.getenv("ENCRYPTION_KEY")
 if not encryption_key:
+    # Each worker would generate its own key and be unable to read files
+    # stored by the others
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        raise RuntimeError("ENCRYPTION_KEY must be set when running multiple workers")
+    
     # Generate a session key and warn
     encryption_key = Fernet.generate_key().decode()
     print("⚠️ WARNING: Using temporary encryption key. Set ENCRYPTION_KEY in .env for production!")
@@ -45,16 +72,28 @@ file_storage = SecureFileStorage(
     encryption_key=encryption_key
 )
 
+# Encryption, decryption and secure deletes are blocking, so they run here
+# instead of on the event loop
+storage_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="storage")
+
+async def run_storage(func, *args, **kwargs):
+    """Run a blocking file_storage call on the storage thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(storage_pool, partial(func, *args, **kwargs))
+
 # Initialize classifier with database for HITL learning
 classifier = ClassificationService(
-    settings.GEMINI_API_KEY, 
+    settings.GEMINI_API_KEYS, 
     enable_dual_verification=settings.ENABLE_DUAL_VERIFICATION,
-    db=hitl_db
+    db=hitl_db,
+    batch_mode=settings.ENABLE_BATCH_API,
+    max_concurrent_requests=settings.GEMINI_MAX_CONCURRENCY,
+    requests_per_minute=settings.GEMINI_REQUESTS_PER_MINUTE,
+    key_rpm=settings.GEMINI_KEY_RPM,
+    key_tpm=settings.GEMINI_KEY_TPM,
+    key_rpd=settings.GEMINI_KEY_RPD
 )
 
-# Store for batch processing status
-batch_jobs = {}
-
 # Ensure directories exist
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 os.makedirs(settings.STORAGE_DIR, exist_ok=True)
@@ -79,42 +118,56 @@ async def root():
             "feedback_insights": "/api/feedback/insights",
             "file_view": "/api/files/view/{file_id}",
             "file_reclassify": "/api/files/reclassify/{file_id}",
+            "file_reclassify_batch": "/api/files/reclassify-batch",
             "file_delete": "/api/files/{file_id}",
             "stats": "/api/stats"
         }
     }
 
-@app.post("/api/classify/single")
-async def classify_single_document(file: UploadFile = File(...)):
+def _validate_upload(file: UploadFile) -> str:
     """
-    Classify a single document with secure storage
+    Check type and size from the upload's headers before its body is read,
+    and return the file extension
     """
     file_extension = file.filename.split(".")[-1].lower()
-    if file_extension not in settings.ALLOWED_EXTENSIONS:
+    if file_extension not in settings.ALLOWED_EXTENSIONS or file.content_type not in settings.ALLOWED_MIMES:
         raise HTTPException(
-            status_code=400, 
-            detail=f"Invalid file type. Allowed: {settings.ALLOWED_EXTENSIONS}"
+            status_code=415,
+            detail=f"Invalid file type. Allowed: {sorted(settings.ALLOWED_EXTENSIONS)}"
         )
     
-    # Save uploaded file temporarily
-    temp_path = os.path.join(settings.UPLOAD_DIR, f"{uuid.uuid4()}_{file.filename}")
+    if file.size is not None and file.size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE // (1024 * 1024)}MB"
+        )
+    
+    return file_extension
+
+@app.post("/api/classify/single")
+async def classify_single_document(file: UploadFile = File(...)):
+    """
+    Classify a single document with secure storage
+    """
+    file_extension = _validate_upload(file)
     
     try:
-        with open(temp_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Classify and store straight from the uploaded bytes instead of
+        # writing a temp copy that storage would then copy again
+        content = await file.read()
         
         # Classify
-        result = await classifier.classify_document(temp_path, file_extension)
+        result = await classifier.classify_document(io.BytesIO(content), file_extension, service_tier="priority")
         
         # Store file securely AFTER classification
-        storage_result = file_storage.store_file(
-            source_path=temp_path,
+        storage_result = await run_storage(
+            file_storage.store_stream,
+            fileobj=io.BytesIO(content),
             filename=file.filename,
             classification=result.get('classification', 'Unknown'),
             metadata={
                 'classification_result': result,
-                'original_size': os.path.getsize(temp_path)
+                'original_size': len(content)
             }
         )
         
@@ -123,8 +176,9 @@ async def classify_single_document(file: UploadFile = File(...)):
             result['stored'] = True
             result['encrypted'] = storage_result['metadata'].get('encrypted', False)
         
-        # Save to audit trail with file_id
-        audit_id = hitl_db.save_audit_log({
+        # Save to audit trail with file_id. The row id is only known once the
+        # background writer inserts it, so the response carries the audit_uid
+        audit_uid = await hitl_db.enqueue_audit({
             'document_name': file.filename,
             'classification': result.get('classification'),
             'confidence': result.get('confidence'),
@@ -133,17 +187,12 @@ async def classify_single_document(file: UploadFile = File(...)):
         })
         
         result['filename'] = file.filename
-        result['audit_id'] = audit_id
+        result['audit_uid'] = audit_uid
         
         return result
-        
+    
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
 
 @app.post("/api/classify/batch")
 async def classify_batch(
@@ -154,13 +203,15 @@ async def classify_batch(
     Classify multiple documents in batch
     """
     job_id = str(uuid.uuid4())
-    batch_jobs[job_id] = {
+    
+    # Job state lives in the database so any worker can report status
+    await asyncio.to_thread(hitl_db.save_batch_job, job_id, {
         "status": "processing",
         "total": len(files),
         "completed": 0,
         "results": [],
         "started_at": datetime.now().isoformat()
-    }
+    })
     
     background_tasks.add_task(process_batch, job_id, files)
     
@@ -174,74 +225,158 @@ async def process_batch(job_id: str, files: List[UploadFile]):
     """
     Background task for batch processing with secure storage
     """
+    job = await asyncio.to_thread(hitl_db.get_batch_job, job_id)
+    
+    # Files are classified in groups sharing one primary Gemini call, with
+    # several groups in flight at once; results are kept in upload order
+    # regardless of which finishes first
+    semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+    results = [None] * len(files)
+    completed = 0
+    
+    async def record(idx: int, entry: Dict):
+        # Only the progress counter is written per file; results are not
+        # served until the job finishes, so they are saved once at the end
+        nonlocal completed
+        results[idx] = entry
+        completed += 1
+        await asyncio.to_thread(hitl_db.update_batch_progress, job_id, completed)
+    
+    valid = []
     for idx, file in enumerate(files):
-        file_extension = file.filename.split(".")[-1].lower()
-        
-        if file_extension not in settings.ALLOWED_EXTENSIONS:
-            batch_jobs[job_id]["results"].append({
+        try:
+            valid.append((idx, file, _validate_upload(file)))
+        except HTTPException as e:
+            await record(idx, {
                 "filename": file.filename,
-                "error": "Invalid file type"
+                "error": e.detail
             })
-            batch_jobs[job_id]["completed"] = idx + 1
-            continue
-        
-        file_path = os.path.join(settings.UPLOAD_DIR, f"{uuid.uuid4()}_{file.filename}")
+    
+    async def handle(group: List[Tuple[int, UploadFile, str]]):
+        async with semaphore:
+            entries = await classify_batch_group(job_id, [(file, ext) for _, file, ext in group])
+        for (idx, _, _), entry in zip(group, entries):
+            await record(idx, entry)
+    
+    size = settings.BATCH_DOCS_PER_CALL
+    await asyncio.gather(*(handle(valid[i:i + size]) for i in range(0, len(valid), size)))
+    
+    job["results"] = results
+    job["completed"] = completed
+    job["status"] = "completed"
+    job["completed_at"] = datetime.now().isoformat()
+    await asyncio.to_thread(hitl_db.save_batch_job, job_id, job)
+
+async def classify_batch_group(job_id: str, uploads: List[Tuple[UploadFile, str]]) -> List[Dict]:
+    """Classify, store and audit a group of batch job files with one batched classification"""
+    saved = await asyncio.gather(*(save_batch_upload(file, ext) for file, ext in uploads),
+                                 return_exceptions=True)
+    
+    try:
+        entries: List[Optional[Dict]] = [None] * len(uploads)
+        classify = []
+        for i, ((file, ext), upload) in enumerate(zip(uploads, saved)):
+            if isinstance(upload, BaseException):
+                entries[i] = {"filename": file.filename, "error": str(upload)}
+            else:
+                classify.append(i)
         
+        # Background job, so the cheaper flex tier's extra latency is fine
         try:
-            with open(file_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
-            
-            result = await classifier.classify_document(file_path, file_extension)
-            
-            # Store file securely
-            storage_result = file_storage.store_file(
-                source_path=file_path,
-                filename=file.filename,
-                classification=result.get('classification', 'Unknown'),
-                metadata={'batch_job': job_id}
+            classified = await classifier.classify_documents_batch(
+                [(saved[i][0], uploads[i][1]) for i in classify],
+                service_tier="flex"
             )
-            
-            if storage_result['success']:
-                result['file_id'] = storage_result['file_id']
-                result['stored'] = True
-            
-            batch_jobs[job_id]["results"].append({
-                "filename": file.filename,
-                "result": result
-            })
-            
-            # Save to audit trail
-            hitl_db.save_audit_log({
-                'document_name': file.filename,
-                'classification': result.get('classification'),
-                'confidence': result.get('confidence'),
-                'action': 'batch_classification',
-                'details': {'job_id': job_id, 'file_id': storage_result.get('file_id')}
-            })
-            
         except Exception as e:
-            batch_jobs[job_id]["results"].append({
-                "filename": file.filename,
-                "error": str(e)
-            })
+            for i in classify:
+                entries[i] = {"filename": uploads[i][0].filename, "error": str(e)}
+            return entries
+        
+        stored = await asyncio.gather(*(
+            store_batch_result(job_id, uploads[i][0], *saved[i], result)
+            for i, result in zip(classify, classified)
+        ))
+        for i, entry in zip(classify, stored):
+            entries[i] = entry
         
-        finally:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        return entries
+    
+    finally:
+        for upload in saved:
+            if not isinstance(upload, BaseException):
+                with suppress(FileNotFoundError):
+                    os.unlink(upload[0])
+
+async def save_batch_upload(file: UploadFile, file_extension: str) -> Tuple[str, int]:
+    """Write an uploaded batch file to a temporary file, returning its path and size"""
+    # Let the OS pick a unique name (O_EXCL) rather than building one
+    # from the user-supplied filename
+    with tempfile.NamedTemporaryFile(dir=settings.UPLOAD_DIR,
+                                     suffix=f".{file_extension}", delete=False) as tmp:
+        file_path = tmp.name
+    
+    try:
+        file_size = 0
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk := await file.read(1 << 20):
+                await f.write(chunk)
+                file_size += len(chunk)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(file_path)
+        raise
+    
+    return file_path, file_size
+
+async def store_batch_result(job_id: str, file: UploadFile, file_path: str,
+                             file_size: int, result: Dict) -> Dict:
+    """Store and audit a single classified file of a batch job"""
+    try:
+        # Store file securely
+        storage_result = await run_storage(
+            file_storage.store_file,
+            source_path=file_path,
+            filename=file.filename,
+            classification=result.get('classification', 'Unknown'),
+            metadata={'batch_job': job_id, 'original_size': file_size}
+        )
+        
+        if storage_result['success']:
+            result['file_id'] = storage_result['file_id']
+            result['stored'] = True
+        
+        # Queue for the audit trail
+        await hitl_db.enqueue_audit({
+            'document_name': file.filename,
+            'classification': result.get('classification'),
+            'confidence': result.get('confidence'),
+            'action': 'batch_classification',
+            'details': {'job_id': job_id, 'file_id': storage_result.get('file_id')}
+        })
         
-        batch_jobs[job_id]["completed"] = idx + 1
+        return {
+            "filename": file.filename,
+            "result": result
+        }
     
-    batch_jobs[job_id]["status"] = "completed"
-    batch_jobs[job_id]["completed_at"] = datetime.now().isoformat()
+    except Exception as e:
+        return {
+            "filename": file.filename,
+            "error": str(e)
+        }
 
 @app.get("/api/batch/{job_id}/status")
 async def get_batch_status(job_id: str):
     """Get status of batch job"""
-    job = batch_jobs.get(job_id)
-    if not job:
+    status = hitl_db.get_batch_status(job_id)
+    if not status:
         raise HTTPException(status_code=404, detail="Job not found")
-    return job
+    
+    # Results are only loaded once the job is no longer running
+    if status['status'] == 'processing':
+        return status
+    
+    return hitl_db.get_batch_job(job_id)
 
 @app.get("/api/files/thumbnail/{file_id}")
 async def get_thumbnail(file_id: str):
@@ -250,29 +385,46 @@ async def get_thumbnail(file_id: str):
     if not metadata or not metadata.get('thumbnail_path'):
         raise HTTPException(status_code=404, detail="Thumbnail not found")
     
-    if not os.path.exists(metadata['thumbnail_path']):
+    stat_result = _stat_file(metadata['thumbnail_path'])
+    if not stat_result:
         raise HTTPException(status_code=404, detail="Thumbnail file missing")
     
-    return FileResponse(metadata['thumbnail_path'], media_type='image/png')
+    # Older thumbnails were stored as PNG
+    return FileResponse(
+        metadata['thumbnail_path'],
+        media_type='image/png' if metadata['thumbnail_path'].endswith('.png') else 'image/jpeg',
+        stat_result=stat_result
+    )
 
 @app.get("/api/files/view/{file_id}")
 async def view_file(file_id: str):
     """View/download file (with access logging)"""
-    file_path = file_storage.retrieve_file(file_id)
-    if not file_path or not os.path.exists(file_path):
+    file_path = await run_storage(file_storage.retrieve_file, file_id)
+    stat_result = _stat_file(file_path)
+    if not stat_result:
         raise HTTPException(status_code=404, detail="File not found")
     
     metadata = file_storage.get_file_metadata(file_id)
     return FileResponse(
         file_path, 
         filename=metadata['original_filename'],
-        media_type='application/octet-stream'
+        media_type='application/octet-stream',
+        stat_result=stat_result
     )
 
+def _stat_file(file_path: str):
+    """Stat a file once for FileResponse, or None if it is missing"""
+    if not file_path:
+        return None
+    try:
+        return os.stat(file_path)
+    except FileNotFoundError:
+        return None
+
 @app.post("/api/files/reclassify/{file_id}")
 async def reclassify_file(file_id: str):
     """Re-classify an existing file"""
-    file_path = file_storage.retrieve_file(file_id)
+    file_path = await run_storage(file_storage.retrieve_file, file_id)
     if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
@@ -280,27 +432,19 @@ async def reclassify_file(file_id: str):
         metadata = file_storage.get_file_metadata(file_id)
         file_extension = metadata['file_type']
         
-        # Re-classify
-        result = await classifier.classify_document(file_path, file_extension)
+        # Re-classify, bypassing the content-hash cache
+        result = await classifier.classify_document(file_path, file_extension, use_cache=False,
+                                                    service_tier="priority")
         
-        # Update stored metadata
-        metadata['classification'] = result.get('classification')
-        metadata['last_reclassified'] = datetime.now().isoformat()
-        metadata['classification_history'] = metadata.get('classification_history', [])
-        metadata['classification_history'].append({
-            'classification': result.get('classification'),
-            'confidence': result.get('confidence'),
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        # Save updated metadata
-        metadata_path = os.path.join(file_storage.metadata_dir, f"{file_id}.json")
-        import json
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        # Update stored classification and history
+        file_storage.record_reclassification(
+            file_id,
+            result.get('classification'),
+            result.get('confidence')
+        )
         
         # Log re-classification
-        hitl_db.save_audit_log({
+        await hitl_db.enqueue_audit({
             'document_name': metadata['original_filename'],
             'classification': result.get('classification'),
             'confidence': result.get('confidence'),
@@ -314,10 +458,96 @@ async def reclassify_file(file_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/files/reclassify-batch")
+async def reclassify_batch(background_tasks: BackgroundTasks, file_ids: List[str]):
+    """
+    Re-classify stored files through the Gemini Batch API. Results can take
+    hours; poll /api/batch/{job_id}/status
+    """
+    if not settings.ENABLE_BATCH_API:
+        raise HTTPException(status_code=400, detail="Batch API re-classification is disabled")
+    
+    job_id = str(uuid.uuid4())
+    await asyncio.to_thread(hitl_db.save_batch_job, job_id, {
+        "status": "processing",
+        "total": len(file_ids),
+        "completed": 0,
+        "results": [],
+        "started_at": datetime.now().isoformat()
+    })
+    
+    background_tasks.add_task(process_reclassify_batch, job_id, file_ids)
+    
+    return {
+        "job_id": job_id,
+        "status": "started",
+        "total_files": len(file_ids)
+    }
+
+async def process_reclassify_batch(job_id: str, file_ids: List[str]):
+    """
+    Background task submitting stored files as one Gemini Batch API job and
+    recording each file's new classification
+    """
+    job = await asyncio.to_thread(hitl_db.get_batch_job, job_id)
+    results = []
+    files = {}
+    names = {}
+    decrypted = []
+    
+    # Decrypt all files at once on the storage pool
+    async def retrieve(file_id: str):
+        metadata = file_storage.get_file_metadata(file_id)
+        file_path = await run_storage(file_storage.retrieve_file, file_id) if metadata else None
+        return metadata, file_path
+    
+    retrieved = await asyncio.gather(*(retrieve(file_id) for file_id in file_ids))
+    
+    for file_id, (metadata, file_path) in zip(file_ids, retrieved):
+        if not file_path:
+            results.append({"file_id": file_id, "error": "File not found"})
+            continue
+        
+        if file_path != metadata['stored_path']:
+            decrypted.append(file_path)
+        files[file_id] = (file_path, metadata['file_type'])
+        names[file_id] = metadata['original_filename']
+    
+    try:
+        classified = await classifier.classify_documents_async_batch(files)
+    finally:
+        for file_path in decrypted:
+            with suppress(FileNotFoundError):
+                os.unlink(file_path)
+    
+    # Batch output is keyed by file ID, so results join straight back
+    for file_id, result in classified.items():
+        if result.get('status') == 'success':
+            file_storage.record_reclassification(
+                file_id,
+                result.get('classification'),
+                result.get('confidence')
+            )
+        
+        await hitl_db.enqueue_audit({
+            'document_name': names.get(file_id),
+            'classification': result.get('classification'),
+            'confidence': result.get('confidence'),
+            'action': 'batch_re-classification',
+            'details': {'job_id': job_id, 'file_id': file_id}
+        })
+        results.append({"file_id": file_id, "result": result})
+    
+    job["results"] = results
+    job["completed"] = len(results)
+    job["status"] = "completed"
+    job["completed_at"] = datetime.now().isoformat()
+    await asyncio.to_thread(hitl_db.save_batch_job, job_id, job)
+
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str, reason: str = "user_request"):
     """Securely delete a file"""
-    success = file_storage.delete_file(file_id, reason)
+    success = await run_storage(file_storage.delete_file, file_id, reason)
     if success:
         return {"status": "success", "message": "File securely deleted"}
     else:
@@ -326,7 +556,7 @@ async def delete_file(file_id: str, reason: str = "user_request"):
 @app.post("/api/files/cleanup")
 async def cleanup_expired_files():
     """Run retention policy cleanup"""
-    result = file_storage.cleanup_expired_files()
+    result = await run_storage(file_storage.cleanup_expired_files)
     return {
         "status": "success",
         "deleted_count": result['deleted_count'],
@@ -351,11 +581,13 @@ async def get_audit_trail(limit: int = 100):
     """Get audit trail"""
     try:
         trail = hitl_db.get_audit_trail(limit)
-        return {
+        
+        # Plain rows from SQLite, so skip jsonable_encoder and serialize once
+        return ORJSONResponse({
             "status": "success",
             "count": len(trail),
             "data": trail
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -364,11 +596,11 @@ async def get_unreviewed_documents(limit: int = 100):
     """Get only unreviewed documents for HITL queue"""
     try:
         unreviewed = hitl_db.get_unreviewed_documents(limit)
-        return {
+        return ORJSONResponse({
             "status": "success",
             "count": len(unreviewed),
             "data": unreviewed
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -379,11 +611,11 @@ async def get_feedback_insights():
         insights = hitl_db.get_correction_insights()
         learned_patterns = hitl_db.get_learned_patterns()
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "insights": insights,
             "learned_patterns": learned_patterns
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -412,4 +644,16 @@ async def health_check():
     }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # A temporary encryption key is generated per process, so it can only
+    # be used with a single worker
+    workers = max(2, (os.cpu_count() or 2) // 2) if os.getenv("ENCRYPTION_KEY") else 1
+    
+    uvicorn.run(
+        # Multiple workers need an import string to load the app in each process
+        "api.main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers
+    )
\ No newline at end of file
@@ -6,6 +6,9 @@ load_dotenv()
 
 class Settings:
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    # Comma-separated keys (separate projects) to spread realtime calls over
+    GEMINI_API_KEYS = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()] \
+        or [GEMINI_API_KEY]
     
     # File storage settings
     UPLOAD_DIR = "uploads/temp"
@@ -13,9 +16,30 @@ class Settings:
         
     # Security settings
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
-    ALLOWED_EXTENSIONS = {"pdf", "png", "jpg", "jpeg"}
+    ALLOWED_EXTENSIONS = frozenset({"pdf", "png", "jpg", "jpeg"})
+    ALLOWED_MIMES = frozenset({"application/pdf", "image/png", "image/jpeg", "image/jpg"})
     ENABLE_DUAL_VERIFICATION = True
     
+    # Files of a batch job sharing one primary classification call, and
+    # how many of those groups are classified concurrently
+    BATCH_DOCS_PER_CALL = 8
+    BATCH_CONCURRENCY = 8
+    
+    # Realtime Gemini calls in flight and per minute across all requests;
+    # size these to the API tier (roughly 2-3 concurrent on the free tier,
+    # 15-20 on tier 1, 50-60 on tier 2)
+    GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "50"))
+    GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "500"))
+    
+    # Quota of each key in GEMINI_API_KEYS
+    GEMINI_KEY_RPM = int(os.getenv("GEMINI_KEY_RPM", "1000"))
+    GEMINI_KEY_TPM = int(os.getenv("GEMINI_KEY_TPM", "1000000"))
+    GEMINI_KEY_RPD = int(os.getenv("GEMINI_KEY_RPD", "10000"))
+    
+    # Non-urgent bulk re-classification through the Gemini Batch API
+    # (half the realtime price, results within 24 hours)
+    ENABLE_BATCH_API = os.getenv("ENABLE_BATCH_API", "false").lower() == "true"
+    
     # Data retention policy
     RETENTION_DAYS = 90  # Keep files for 90 days
     AUTO_DELETE_ENABLED = True
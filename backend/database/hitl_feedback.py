@@ -1,22 +1,258 @@
+import asyncio
 import json
+import logging
 import os
+import queue
+import threading
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
+from pathlib import Path
 from typing import List, Dict, Optional
 import sqlite3
+import orjson
+from cachetools import LRUCache
+
+_log = logging.getLogger(__name__)
+
+# Statements used at runtime are kept as module constants so every call
+# passes the same string and hits the connection's prepared statement cache
+_SQL_INSERT_FEEDBACK = '''
+    INSERT INTO feedback
+    (document_id, original_classification, corrected_classification,
+     reviewer_name, reviewer_comments, confidence_score, evidence, is_agreement)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_SQL_MARK_REVIEWED = '''
+    INSERT OR REPLACE INTO review_status
+    (document_id, reviewed, review_timestamp, reviewer_name)
+    VALUES (?, 1, CURRENT_TIMESTAMP, ?)
+'''
+
+_SQL_MARK_AUDIT_REVIEWED = '''
+    UPDATE audit_trail
+    SET reviewed = 1, review_timestamp = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+
+_SQL_UPSERT_PATTERN = '''
+    INSERT INTO learned_patterns
+    (pattern_type, from_classification, to_classification, frequency, context)
+    VALUES ('misclassification', ?, ?, 1, ?)
+    ON CONFLICT(from_classification, to_classification) DO UPDATE
+    SET frequency = frequency + 1,
+        last_seen = CURRENT_TIMESTAMP,
+        context = substr(COALESCE(context, '') || ' | ' || excluded.context, 1, 4000)
+'''
+
+_SQL_SELECT_REVIEWED = '''
+    SELECT EXISTS(
+        SELECT 1 FROM review_status WHERE document_id = ? AND reviewed = 1
+    )
+'''
+
+_SQL_SELECT_UNREVIEWED = '''
+    SELECT a.* FROM audit_trail a
+    LEFT JOIN review_status r ON a.id = r.document_id
+    WHERE (r.reviewed IS NULL OR r.reviewed = 0)
+    AND a.classification IS NOT NULL
+    ORDER BY a.timestamp DESC
+    LIMIT ?
+'''
+
+_SQL_SELECT_PATTERNS = '''
+    SELECT * FROM learned_patterns
+    ORDER BY frequency DESC, last_seen DESC
+'''
+
+_SQL_SELECT_COMMON_CORRECTIONS = '''
+    SELECT from_classification, to_classification, frequency, context
+    FROM learned_patterns
+    WHERE frequency >= 3
+    ORDER BY frequency DESC
+    LIMIT 10
+'''
+
+_SQL_SELECT_AGREEMENT_BY_CLASS = '''
+    SELECT original_classification,
+           SUM(CASE WHEN is_agreement = 1 THEN 1 ELSE 0 END) as agreements,
+           COUNT(*) as total
+    FROM feedback
+    GROUP BY original_classification
+'''
+
+_SQL_INSERT_AUDIT = '''
+    INSERT INTO audit_trail
+    (document_name, classification, confidence, user_id, action, details, audit_uid)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+_SQL_SELECT_AUDIT_ID_BY_UID = '''
+    SELECT id FROM audit_trail WHERE audit_uid = ?
+'''
+
+_SQL_SELECT_AUDIT_TRAIL = '''
+    SELECT * FROM audit_trail
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+_SQL_SELECT_AUDIT_UNREVIEWED = '''
+    SELECT * FROM audit_trail
+    WHERE reviewed = 0
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+_SQL_SELECT_FEEDBACK_FOR_DOC = '''
+    SELECT * FROM feedback
+    WHERE document_id = ?
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+_SQL_SELECT_FEEDBACK = '''
+    SELECT * FROM feedback
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+# Feedback rows are never deleted, so the newest id only grows; a rowid
+# lookup, and read from the database so every worker sees the same value
+_SQL_SELECT_FEEDBACK_VERSION = 'SELECT COALESCE(MAX(id), 0) FROM feedback'
+
+_SQL_SELECT_STATS = '''
+    SELECT classification, count, conf_sum, conf_count, reviewed_count
+    FROM stats_by_class
+'''
+
+_SQL_UPSERT_BATCH_JOB = '''
+    INSERT INTO batch_jobs
+    (job_id, status, total, completed, results_json, started_at, completed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(job_id) DO UPDATE
+    SET status = excluded.status,
+        total = excluded.total,
+        completed = excluded.completed,
+        results_json = excluded.results_json,
+        completed_at = excluded.completed_at
+'''
+
+_SQL_UPDATE_BATCH_PROGRESS = '''
+    UPDATE batch_jobs SET completed = MAX(completed, ?)
+    WHERE job_id = ?
+'''
+
+_SQL_SELECT_BATCH_JOB = 'SELECT * FROM batch_jobs WHERE job_id = ?'
+
+_SQL_SELECT_BATCH_STATUS = '''
+    SELECT status, total, completed, started_at, completed_at
+    FROM batch_jobs WHERE job_id = ?
+'''
+
+_SQL_SELECT_CACHED_CLASSIFICATION = '''
+    SELECT result_json FROM class_cache
+    WHERE content_hash = ? AND expires_at > CURRENT_TIMESTAMP
+'''
+
+_SQL_UPSERT_CACHED_CLASSIFICATION = '''
+    INSERT INTO class_cache (content_hash, result_json, created_at, expires_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP, datetime('now', ?))
+    ON CONFLICT(content_hash) DO UPDATE
+    SET result_json = excluded.result_json,
+        created_at = excluded.created_at,
+        expires_at = excluded.expires_at
+'''
+
+_SQL_LAST_ROWID = 'SELECT last_insert_rowid()'
 
 class HITLDatabase:
     """
     Enhanced database for HITL feedback with persistent review tracking
     """
-    def __init__(self, db_path: str = "hitl_feedback.db"):
+    def __init__(self, db_path: str = "hitl_feedback.db", read_pool_size: Optional[int] = None):
         self.db_path = db_path
         self.init_database()
+        
+        # SQLite allows a single writer, so keep one long-lived write connection
+        self._write_conn = self._connect()
+        self._write_lock = threading.Lock()
+        
+        # Read-only connections run alongside the writer under WAL
+        pool_size = read_pool_size or os.cpu_count() or 4
+        self._read_pool = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._read_pool.put(self._connect(read_only=True))
+        
+        # Status (not results) of batch jobs, for cheap progress polling
+        self._batch_status = LRUCache(maxsize=256)
+        self._batch_status_lock = threading.Lock()
+        
+        # Audit rows queued from request handlers, written by _audit_flusher
+        self._audit_queue: Optional[asyncio.Queue] = None
+        self._audit_task: Optional[asyncio.Task] = None
+    
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Open a connection with the per-connection concurrency settings"""
+        if read_only:
+            uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, isolation_level=None,
+                                   check_same_thread=False, cached_statements=256)
+        else:
+            conn = sqlite3.connect(self.db_path, isolation_level=None,
+                                   check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    @contextmanager
+    def _transaction(self):
+        """Yield a cursor on the shared write connection inside a transaction"""
+        with self._write_lock:
+            cursor = self._write_conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except Exception:
+                self._write_conn.rollback()
+                raise
+            else:
+                self._write_conn.commit()
+            finally:
+                cursor.close()
+    
+    @contextmanager
+    def _reader(self, row_factory=None):
+        """Borrow a pooled read-only connection and yield a cursor on it"""
+        conn = self._read_pool.get()
+        try:
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            yield cursor
+            cursor.close()
+        finally:
+            self._read_pool.put(conn)
+    
+    @staticmethod
+    def _fetch_dicts(cursor) -> List[Dict]:
+        """Fetch plain tuples and zip them with the column names once"""
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
     
     def init_database(self):
         """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # WAL lets readers proceed alongside the writer; journal_mode is
+        # persistent, the rest are tuned for this connection
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-20000')
+        cursor.execute('PRAGMA foreign_keys=ON')
+        
         # Create feedback table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS feedback (
@@ -45,10 +281,16 @@ class HITLDatabase:
                 action TEXT,
                 details TEXT,
                 reviewed BOOLEAN DEFAULT 0,
-                review_timestamp DATETIME
+                review_timestamp DATETIME,
+                audit_uid TEXT
             )
         ''')
         
+        # Older databases predate the client-generated audit id
+        cursor.execute('PRAGMA table_info(audit_trail)')
+        if 'audit_uid' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE audit_trail ADD COLUMN audit_uid TEXT')
+        
         # Create review status tracking table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS review_status (
@@ -75,181 +317,326 @@ class HITLDatabase:
             )
         ''')
         
+        # Create batch job table so job status is shared across workers
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                total INTEGER DEFAULT 0,
+                completed INTEGER DEFAULT 0,
+                results_json TEXT,
+                started_at DATETIME,
+                completed_at DATETIME
+            )
+        ''')
+        
+        # Classification results keyed by SHA-256 of the document content
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS class_cache (
+                content_hash TEXT PRIMARY KEY,
+                result_json TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME NOT NULL
+            )
+        ''')
+        
+        # Databases from before the pattern upsert can hold several rows per
+        # (from, to) pair, which would make the unique index below fail
+        self._merge_duplicate_patterns(cursor)
+        
+        # Indexes for the review queue ordering and the pattern upsert key
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_audit_reviewed_ts
+            ON audit_trail(reviewed, timestamp DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_audit_ts
+            ON audit_trail(timestamp DESC)
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_patterns_from_to
+            ON learned_patterns(from_classification, to_classification)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_feedback_doc
+            ON feedback(document_id)
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_audit_uid
+            ON audit_trail(audit_uid)
+        ''')
+        
+        self._init_stats_summary(cursor)
+        
         conn.commit()
         conn.close()
     
-    def save_feedback(self, feedback: Dict) -> int:
-        """Save HITL feedback and mark document as reviewed"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _merge_duplicate_patterns(self, cursor):
+        """
+        Fold duplicate learned_patterns rows into the oldest one per
+        (from, to) pair: frequencies are summed and contexts concatenated
+        """
+        # One write transaction, so workers starting together merge once
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'index' AND name = 'idx_patterns_from_to'
+        ''')
+        if cursor.fetchone():
+            cursor.execute('COMMIT')
+            return
         
-        # Determine if this is an agreement or correction
-        is_agreement = feedback.get('original_classification') == feedback.get('corrected_classification')
+        # NULLs never collide in a unique index, so only complete pairs merge
+        cursor.execute('''
+            CREATE TEMP TABLE pattern_merge AS
+            SELECT MIN(id) AS keep_id,
+                   from_classification,
+                   to_classification,
+                   SUM(frequency) AS frequency,
+                   MIN(created_at) AS created_at,
+                   MAX(last_seen) AS last_seen
+            FROM learned_patterns
+            WHERE from_classification IS NOT NULL AND to_classification IS NOT NULL
+            GROUP BY from_classification, to_classification
+            HAVING COUNT(*) > 1
+        ''')
+        cursor.execute('''
+            UPDATE learned_patterns
+            SET frequency = m.frequency,
+                created_at = m.created_at,
+                last_seen = m.last_seen,
+                context = substr((
+                    SELECT group_concat(context, ' | ') FROM (
+                        SELECT p.context FROM learned_patterns p
+                        WHERE p.from_classification = m.from_classification
+                        AND p.to_classification = m.to_classification
+                        AND p.context IS NOT NULL AND p.context != ''
+                        ORDER BY p.id
+                    )
+                ), 1, 4000)
+            FROM pattern_merge m
+            WHERE learned_patterns.id = m.keep_id
+        ''')
+        cursor.execute('''
+            DELETE FROM learned_patterns
+            WHERE id IN (
+                SELECT p.id FROM learned_patterns p
+                JOIN pattern_merge m
+                ON p.from_classification = m.from_classification
+                AND p.to_classification = m.to_classification
+                WHERE p.id != m.keep_id
+            )
+        ''')
+        cursor.execute('DROP TABLE pattern_merge')
         
         cursor.execute('''
-            INSERT INTO feedback 
-            (document_id, original_classification, corrected_classification, 
-             reviewer_name, reviewer_comments, confidence_score, evidence, is_agreement)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            feedback.get('document_id'),
-            feedback.get('original_classification'),
-            feedback.get('corrected_classification'),
-            feedback.get('reviewer_name'),
-            feedback.get('reviewer_comments'),
-            feedback.get('confidence_score'),
-            json.dumps(feedback.get('evidence', [])),
-            is_agreement
-        ))
-        
-        feedback_id = cursor.lastrowid
-        
-        # Mark document as reviewed
+            CREATE UNIQUE INDEX idx_patterns_from_to
+            ON learned_patterns(from_classification, to_classification)
+        ''')
+        cursor.execute('COMMIT')
+    
+    def _init_stats_summary(self, cursor):
+        """
+        Per-classification counters kept current by triggers on audit_trail,
+        so statistics don't need to scan the whole trail
+        """
+        # Creation and backfill happen in one write transaction so workers
+        # starting together can't both backfill
+        cursor.execute('BEGIN IMMEDIATE')
         cursor.execute('''
-            INSERT OR REPLACE INTO review_status 
-            (document_id, reviewed, review_timestamp, reviewer_name)
-            VALUES (?, 1, CURRENT_TIMESTAMP, ?)
-        ''', (int(feedback.get('document_id')), feedback.get('reviewer_name')))
+            SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats_by_class'
+        ''')
+        exists = cursor.fetchone() is not None
         
-        # Update audit trail
         cursor.execute('''
-            UPDATE audit_trail 
-            SET reviewed = 1, review_timestamp = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (int(feedback.get('document_id')),))
-        
-        # If this is a correction, learn from it
-        if not is_agreement:
-            self._record_learned_pattern(
-                cursor,
-                feedback.get('original_classification'),
-                feedback.get('corrected_classification'),
-                feedback.get('reviewer_comments', '')
+            CREATE TABLE IF NOT EXISTS stats_by_class (
+                classification TEXT PRIMARY KEY,
+                count INTEGER DEFAULT 0,
+                conf_sum REAL DEFAULT 0,
+                conf_count INTEGER DEFAULT 0,
+                reviewed_count INTEGER DEFAULT 0
             )
+        ''')
         
-        conn.commit()
-        conn.close()
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_audit_stats_insert
+            AFTER INSERT ON audit_trail
+            BEGIN
+                INSERT INTO stats_by_class
+                (classification, count, conf_sum, conf_count, reviewed_count)
+                VALUES (NEW.classification, 1, COALESCE(NEW.confidence, 0),
+                        NEW.confidence IS NOT NULL, NEW.reviewed = 1)
+                ON CONFLICT(classification) DO UPDATE
+                SET count = count + 1,
+                    conf_sum = conf_sum + excluded.conf_sum,
+                    conf_count = conf_count + excluded.conf_count,
+                    reviewed_count = reviewed_count + excluded.reviewed_count;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_audit_stats_delete
+            AFTER DELETE ON audit_trail
+            BEGIN
+                UPDATE stats_by_class
+                SET count = count - 1,
+                    conf_sum = conf_sum - COALESCE(OLD.confidence, 0),
+                    conf_count = conf_count - (OLD.confidence IS NOT NULL),
+                    reviewed_count = reviewed_count - (OLD.reviewed = 1)
+                WHERE classification = OLD.classification;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_audit_stats_update
+            AFTER UPDATE OF classification, confidence, reviewed ON audit_trail
+            BEGIN
+                UPDATE stats_by_class
+                SET count = count - 1,
+                    conf_sum = conf_sum - COALESCE(OLD.confidence, 0),
+                    conf_count = conf_count - (OLD.confidence IS NOT NULL),
+                    reviewed_count = reviewed_count - (OLD.reviewed = 1)
+                WHERE classification = OLD.classification;
+                INSERT INTO stats_by_class
+                (classification, count, conf_sum, conf_count, reviewed_count)
+                VALUES (NEW.classification, 1, COALESCE(NEW.confidence, 0),
+                        NEW.confidence IS NOT NULL, NEW.reviewed = 1)
+                ON CONFLICT(classification) DO UPDATE
+                SET count = count + 1,
+                    conf_sum = conf_sum + excluded.conf_sum,
+                    conf_count = conf_count + excluded.conf_count,
+                    reviewed_count = reviewed_count + excluded.reviewed_count;
+            END
+        ''')
+        
+        # Existing databases: seed the counters from the current trail
+        if not exists:
+            cursor.execute('''
+                INSERT INTO stats_by_class
+                (classification, count, conf_sum, conf_count, reviewed_count)
+                SELECT classification, COUNT(*), COALESCE(SUM(confidence), 0),
+                       COUNT(confidence), SUM(reviewed = 1)
+                FROM audit_trail
+                GROUP BY classification
+            ''')
+        
+        cursor.execute('COMMIT')
+    
+    def save_feedback(self, feedback: Dict) -> int:
+        """
+        Save HITL feedback and mark document as reviewed. document_id is the
+        audit trail row id, or the audit_uid returned by the classify endpoint
+        """
+        # Determine if this is an agreement or correction
+        is_agreement = feedback.get('original_classification') == feedback.get('corrected_classification')
+        
+        with self._transaction() as cursor:
+            document_id = self._resolve_audit_id(cursor, feedback.get('document_id'))
+            
+            cursor.execute(_SQL_INSERT_FEEDBACK, (
+                str(document_id),
+                feedback.get('original_classification'),
+                feedback.get('corrected_classification'),
+                feedback.get('reviewer_name'),
+                feedback.get('reviewer_comments'),
+                feedback.get('confidence_score'),
+                json.dumps(feedback.get('evidence', [])),
+                is_agreement
+            ))
+            
+            feedback_id = cursor.lastrowid
+            
+            # Mark document as reviewed
+            cursor.execute(_SQL_MARK_REVIEWED, (
+                document_id,
+                feedback.get('reviewer_name')
+            ))
+            
+            # Update audit trail
+            cursor.execute(_SQL_MARK_AUDIT_REVIEWED, (document_id,))
+            
+            # If this is a correction, learn from it
+            if not is_agreement:
+                self._record_learned_pattern(
+                    cursor,
+                    feedback.get('original_classification'),
+                    feedback.get('corrected_classification'),
+                    feedback.get('reviewer_comments', '')
+                )
         
         return feedback_id
     
+    def _resolve_audit_id(self, cursor, document_id) -> int:
+        """Audit trail row id for a row id or an audit_uid"""
+        if isinstance(document_id, int) or str(document_id).isdigit():
+            return int(document_id)
+        
+        cursor.execute(_SQL_SELECT_AUDIT_ID_BY_UID, (document_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Unknown audit entry: {document_id}")
+        return row[0]
+    
+    def get_feedback_version(self) -> int:
+        """
+        Id of the newest feedback row, which changes whenever feedback is
+        saved through any worker, so derived data (e.g. prompt enhancements)
+        can tell when to recompute
+        """
+        with self._reader() as cursor:
+            cursor.execute(_SQL_SELECT_FEEDBACK_VERSION)
+            return cursor.fetchone()[0]
+    
     def _record_learned_pattern(self, cursor, from_class: str, to_class: str, comments: str):
         """Record a learned pattern from corrections"""
-        # Check if this pattern already exists
-        cursor.execute('''
-            SELECT id, frequency FROM learned_patterns
-            WHERE from_classification = ? AND to_classification = ?
-        ''', (from_class, to_class))
-        
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Increment frequency
-            cursor.execute('''
-                UPDATE learned_patterns
-                SET frequency = frequency + 1,
-                    last_seen = CURRENT_TIMESTAMP,
-                    context = context || ' | ' || ?
-                WHERE id = ?
-            ''', (comments[:200], existing[0]))
-        else:
-            # Create new pattern
-            cursor.execute('''
-                INSERT INTO learned_patterns
-                (pattern_type, from_classification, to_classification, frequency, context)
-                VALUES ('misclassification', ?, ?, 1, ?)
-            ''', (from_class, to_class, comments[:200]))
+        # Upsert on the (from, to) unique index: insert or bump the frequency.
+        # Context accumulates with every correction, so cap it at 4000 chars
+        cursor.execute(_SQL_UPSERT_PATTERN, (from_class, to_class, comments[:200]))
     
     def is_document_reviewed(self, document_id: int) -> bool:
         """Check if a document has been reviewed"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT reviewed FROM review_status WHERE document_id = ?
-        ''', (document_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        return result and result[0] == 1
+        with self._reader() as cursor:
+            cursor.execute(_SQL_SELECT_REVIEWED, (document_id,))
+            
+            return bool(cursor.fetchone()[0])
     
     def get_unreviewed_documents(self, limit: int = 100) -> List[Dict]:
         """Get documents that haven't been reviewed yet"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT a.* FROM audit_trail a
-            LEFT JOIN review_status r ON a.id = r.document_id
-            WHERE (r.reviewed IS NULL OR r.reviewed = 0)
-            AND a.classification IS NOT NULL
-            ORDER BY a.timestamp DESC
-            LIMIT ?
-        ''', (limit,))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        with self._reader() as cursor:
+            cursor.execute(_SQL_SELECT_UNREVIEWED, (limit,))
+            
+            return self._parse_details(self._fetch_dicts(cursor))
     
     def get_learned_patterns(self) -> List[Dict]:
         """Get all learned patterns from corrections"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM learned_patterns
-            ORDER BY frequency DESC, last_seen DESC
-        ''')
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        with self._reader() as cursor:
+            cursor.execute(_SQL_SELECT_PATTERNS)
+            
+            return self._fetch_dicts(cursor)
     
     def get_correction_insights(self) -> Dict:
         """Get insights from corrections for prompt improvement"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Most common corrections
-        cursor.execute('''
-            SELECT from_classification, to_classification, frequency, context
-            FROM learned_patterns
-            WHERE frequency >= 3
-            ORDER BY frequency DESC
-            LIMIT 10
-        ''')
-        
-        common_corrections = []
-        for row in cursor.fetchall():
-            common_corrections.append({
-                'from': row[0],
-                'to': row[1],
-                'count': row[2],
-                'examples': row[3].split(' | ')[:3]
-            })
-        
-        # Agreement rate by classification
-        cursor.execute('''
-            SELECT original_classification, 
-                   SUM(CASE WHEN is_agreement = 1 THEN 1 ELSE 0 END) as agreements,
-                   COUNT(*) as total
-            FROM feedback
-            GROUP BY original_classification
-        ''')
-        
-        accuracy_by_class = {}
-        for row in cursor.fetchall():
-            accuracy_by_class[row[0]] = {
-                'agreements': row[1],
-                'total': row[2],
-                'accuracy': (row[1] / row[2] * 100) if row[2] > 0 else 0
-            }
-        
-        conn.close()
+        with self._reader() as cursor:
+            # Most common corrections
+            cursor.execute(_SQL_SELECT_COMMON_CORRECTIONS)
+            
+            common_corrections = []
+            for row in cursor.fetchall():
+                common_corrections.append({
+                    'from': row[0],
+                    'to': row[1],
+                    'count': row[2],
+                    'examples': row[3].split(' | ')[:3]
+                })
+            
+            # Agreement rate by classification
+            cursor.execute(_SQL_SELECT_AGREEMENT_BY_CLASS)
+            
+            accuracy_by_class = {}
+            for row in cursor.fetchall():
+                accuracy_by_class[row[0]] = {
+                    'agreements': row[1],
+                    'total': row[2],
+                    'accuracy': (row[1] / row[2] * 100) if row[2] > 0 else 0
+                }
         
         return {
             'common_corrections': common_corrections,
@@ -258,111 +645,178 @@ class HITLDatabase:
     
     def save_audit_log(self, log_entry: Dict) -> int:
         """Save audit trail entry"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._transaction() as cursor:
+            cursor.execute(_SQL_INSERT_AUDIT, self._audit_row(log_entry))
+            
+            audit_id = cursor.lastrowid
         
-        cursor.execute('''
-            INSERT INTO audit_trail 
-            (document_name, classification, confidence, user_id, action, details)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
+        return audit_id
+    
+    def save_audit_logs_bulk(self, log_entries: List[Dict]) -> List[int]:
+        """Save several audit trail entries in a single transaction"""
+        if not log_entries:
+            return []
+        
+        rows = [self._audit_row(entry) for entry in log_entries]
+        
+        with self._transaction() as cursor:
+            cursor.executemany(_SQL_INSERT_AUDIT, rows)
+            
+            cursor.execute(_SQL_LAST_ROWID)
+            last_id = cursor.fetchone()[0]
+        
+        # Ids are contiguous because the single writer holds the transaction
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+    
+    def _audit_row(self, log_entry: Dict) -> tuple:
+        """Build the audit_trail insert parameters for a log entry"""
+        return (
             log_entry.get('document_name'),
             log_entry.get('classification'),
             log_entry.get('confidence'),
             log_entry.get('user_id', 'system'),
             log_entry.get('action', 'classification'),
-            json.dumps(log_entry.get('details', {}))
-        ))
-        
-        audit_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            orjson.dumps(
+                log_entry.get('details', {}),
+                default=str,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            ).decode(),
+            log_entry.get('audit_uid')
+        )
+    
+    async def enqueue_audit(self, log_entry: Dict) -> str:
+        """
+        Queue an audit trail entry for the background writer and return its
+        audit_uid straight away, without waiting for the insert
+        """
+        entry = {**log_entry, 'audit_uid': log_entry.get('audit_uid') or str(uuid.uuid4())}
+        
+        if self._audit_queue is None:
+            # No flusher running (e.g. used outside the API), write directly
+            await asyncio.to_thread(self.save_audit_log, entry)
+        else:
+            await self._audit_queue.put(entry)
         
-        return audit_id
+        return entry['audit_uid']
+    
+    def start_audit_flusher(self):
+        """Start the background audit writer on the running event loop"""
+        if self._audit_task is None:
+            self._audit_queue = asyncio.Queue()
+            self._audit_task = asyncio.create_task(self._audit_flusher())
+    
+    async def stop_audit_flusher(self):
+        """Flush any queued audit entries and stop the background writer"""
+        if self._audit_task is None:
+            return
+        
+        await self._audit_queue.join()
+        self._audit_task.cancel()
+        try:
+            await self._audit_task
+        except asyncio.CancelledError:
+            pass
+        
+        self._audit_queue = None
+        self._audit_task = None
+    
+    async def _audit_flusher(self, max_rows: int = 128, max_wait: float = 0.05):
+        """Write queued audit entries in batches of up to max_rows or every max_wait seconds"""
+        while True:
+            batch = [await self._audit_queue.get()]
+            self._drain_audit_queue(batch, max_rows)
+            
+            # One timed wait for more entries to arrive. Waiting on get() with
+            # a timeout could take an entry and then drop it on Python 3.11
+            if len(batch) < max_rows:
+                await asyncio.sleep(max_wait)
+                self._drain_audit_queue(batch, max_rows)
+            
+            try:
+                await self._write_audit_batch(batch)
+            finally:
+                for _ in batch:
+                    self._audit_queue.task_done()
+    
+    def _drain_audit_queue(self, batch: List[Dict], max_rows: int):
+        """Move already queued audit entries into batch, up to max_rows"""
+        while len(batch) < max_rows:
+            try:
+                batch.append(self._audit_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return
+    
+    async def _write_audit_batch(self, batch: List[Dict], attempts: int = 3):
+        """
+        Insert a batch of audit entries, retrying the whole batch and then
+        falling back to one row at a time, so one bad entry or a locked
+        database doesn't lose the rest. Callers already hold the audit_uids
+        """
+        for attempt in range(attempts):
+            try:
+                await asyncio.to_thread(self.save_audit_logs_bulk, batch)
+                return
+            except Exception:
+                _log.warning("Audit trail batch of %d rows failed (attempt %d/%d)",
+                             len(batch), attempt + 1, attempts, exc_info=True)
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        
+        for entry in batch:
+            try:
+                await asyncio.to_thread(self.save_audit_log, entry)
+            except Exception:
+                _log.exception("Could not write audit trail entry %s: %r",
+                               entry.get('audit_uid'), entry)
     
     def get_audit_trail(self, limit: int = 100, include_reviewed: bool = True) -> List[Dict]:
         """Retrieve audit trail entries"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        if include_reviewed:
-            cursor.execute('''
-                SELECT * FROM audit_trail 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-        else:
-            cursor.execute('''
-                SELECT * FROM audit_trail 
-                WHERE reviewed = 0
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        with self._reader() as cursor:
+            if include_reviewed:
+                cursor.execute(_SQL_SELECT_AUDIT_TRAIL, (limit,))
+            else:
+                cursor.execute(_SQL_SELECT_AUDIT_UNREVIEWED, (limit,))
+            
+            return self._parse_details(self._fetch_dicts(cursor))
+    
+    @staticmethod
+    def _parse_details(rows: List[Dict]) -> List[Dict]:
+        """Decode the stored details JSON so responses nest it as an object"""
+        for row in rows:
+            if row.get('details'):
+                try:
+                    row['details'] = orjson.loads(row['details'])
+                except orjson.JSONDecodeError:
+                    pass
+        return rows
     
     def get_feedback_history(self, document_id: str = None, limit: int = 100) -> List[Dict]:
         """Retrieve feedback history"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        if document_id:
-            cursor.execute('''
-                SELECT * FROM feedback 
-                WHERE document_id = ?
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (document_id, limit))
-        else:
-            cursor.execute('''
-                SELECT * FROM feedback 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [dict(row) for row in rows]
+        with self._reader() as cursor:
+            if document_id:
+                cursor.execute(_SQL_SELECT_FEEDBACK_FOR_DOC, (document_id, limit))
+            else:
+                cursor.execute(_SQL_SELECT_FEEDBACK, (limit,))
+            
+            return self._fetch_dicts(cursor)
     
     def get_classification_stats(self) -> Dict:
         """Get statistics about classifications"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Count by classification
-        cursor.execute('''
-            SELECT classification, COUNT(*) as count 
-            FROM audit_trail 
-            GROUP BY classification
-        ''')
-        
-        classification_counts = dict(cursor.fetchall())
-        
-        # Average confidence by classification
-        cursor.execute('''
-            SELECT classification, AVG(confidence) as avg_confidence 
-            FROM audit_trail 
-            WHERE confidence IS NOT NULL
-            GROUP BY classification
-        ''')
-        
-        avg_confidence = dict(cursor.fetchall())
-        
-        # Total documents processed
-        cursor.execute('SELECT COUNT(*) FROM audit_trail')
-        total_docs = cursor.fetchone()[0]
-        
-        # Review statistics
-        cursor.execute('SELECT COUNT(*) FROM audit_trail WHERE reviewed = 1')
-        reviewed_docs = cursor.fetchone()[0]
-        
-        conn.close()
+        # One row per classification, maintained by the audit_trail triggers
+        with self._reader() as cursor:
+            cursor.execute(_SQL_SELECT_STATS)
+            rows = cursor.fetchall()
+        
+        classification_counts = {}
+        avg_confidence = {}
+        total_docs = 0
+        reviewed_docs = 0
+        for classification, count, conf_sum, conf_count, reviewed_count in rows:
+            if count > 0:
+                classification_counts[classification] = count
+            if conf_count > 0:
+                avg_confidence[classification] = conf_sum / conf_count
+            total_docs += count
+            reviewed_docs += reviewed_count
         
         return {
             'total_documents': total_docs,
@@ -370,4 +824,114 @@ class HITLDatabase:
             'pending_review': total_docs - reviewed_docs,
             'classification_counts': classification_counts,
             'average_confidence': avg_confidence
-        }
\ No newline at end of file
+        }
+    
+    def get_cached_classification(self, content_hash: str) -> Optional[Dict]:
+        """Get an unexpired classification result for a document hash"""
+        with self._reader() as cursor:
+            cursor.execute(_SQL_SELECT_CACHED_CLASSIFICATION, (content_hash,))
+            
+            row = cursor.fetchone()
+        
+        return orjson.loads(row[0]) if row else None
+    
+    def save_cached_classification(self, content_hash: str, result: Dict, ttl_days: int = 90):
+        """Cache a classification result for a document hash"""
+        with self._transaction() as cursor:
+            cursor.execute(_SQL_UPSERT_CACHED_CLASSIFICATION, (
+                content_hash,
+                orjson.dumps(result, default=str, option=orjson.OPT_NON_STR_KEYS).decode(),
+                f'+{ttl_days} days'
+            ))
+    
+    def save_batch_job(self, job_id: str, job: Dict):
+        """Create or update the stored state of a batch job"""
+        with self._transaction() as cursor:
+            cursor.execute(_SQL_UPSERT_BATCH_JOB, (
+                job_id,
+                job.get('status'),
+                job.get('total', 0),
+                job.get('completed', 0),
+                orjson.dumps(
+                    job.get('results', []),
+                    default=str,
+                    option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+                ).decode(),
+                job.get('started_at'),
+                job.get('completed_at')
+            ))
+        
+        # Jobs run in the process that saves them, so this entry stays current
+        with self._batch_status_lock:
+            self._batch_status[job_id] = self._batch_status_fields(job)
+    
+    def update_batch_progress(self, job_id: str, completed: int):
+        """Record how many files of a running batch job are done, without rewriting its results"""
+        with self._transaction() as cursor:
+            cursor.execute(_SQL_UPDATE_BATCH_PROGRESS, (completed, job_id))
+        
+        with self._batch_status_lock:
+            status = self._batch_status.get(job_id)
+            if status is not None:
+                status['completed'] = max(status['completed'], completed)
+    
+    def get_batch_job(self, job_id: str) -> Optional[Dict]:
+        """Get the status and results of a batch job"""
+        with self._reader(sqlite3.Row) as cursor:
+            cursor.execute(_SQL_SELECT_BATCH_JOB, (job_id,))
+            
+            row = cursor.fetchone()
+        
+        if not row:
+            return None
+        
+        job = {
+            'status': row['status'],
+            'total': row['total'],
+            'completed': row['completed'],
+            'results': orjson.loads(row['results_json'] or '[]'),
+            'started_at': row['started_at']
+        }
+        if row['completed_at']:
+            job['completed_at'] = row['completed_at']
+        
+        return job
+    
+    def get_batch_status(self, job_id: str) -> Optional[Dict]:
+        """Get the progress of a batch job without loading its results"""
+        with self._batch_status_lock:
+            status = self._batch_status.get(job_id)
+        if status is not None:
+            return dict(status)
+        
+        with self._reader(sqlite3.Row) as cursor:
+            cursor.execute(_SQL_SELECT_BATCH_STATUS, (job_id,))
+            
+            row = cursor.fetchone()
+        
+        if not row:
+            return None
+        
+        status = self._batch_status_fields(dict(row))
+        
+        # Another worker may still be updating an in-flight job, so only
+        # finished jobs are safe to cache here
+        if status['status'] != 'processing':
+            with self._batch_status_lock:
+                self._batch_status[job_id] = status
+        
+        return dict(status)
+    
+    @staticmethod
+    def _batch_status_fields(job: Dict) -> Dict:
+        """Pick the progress fields of a batch job"""
+        status = {
+            'status': job.get('status'),
+            'total': job.get('total', 0),
+            'completed': job.get('completed', 0),
+            'started_at': job.get('started_at')
+        }
+        if job.get('completed_at'):
+            status['completed_at'] = job['completed_at']
+        
+        return status
\ No newline at end of file
@@ -3,27 +3,79 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from typing import Dict, List, Any
-from services.gemini_service import GeminiService
+from typing import Dict, List, Any, Optional, Tuple, Union, BinaryIO
+from services.gemini_service import GeminiService, gemini_service_tier, CHARS_PER_TOKEN, TOKENS_PER_IMAGE
+from services.key_pool import GeminiKeyPool, DEFAULT_KEY_RPM, DEFAULT_KEY_TPM, DEFAULT_KEY_RPD
 from services.preprocessing import PreprocessingService
 from utils.prompt_library import PromptLibrary
+from utils.hashing import file_sha256, text_sha256
+from utils.llm_cache import LLMCache, bypass_llm_cache
+from utils.json_extract import strip_code_fence, find_json_objects
+from aiolimiter import AsyncLimiter
 import asyncio
-import json
+import orjson
 import re
 
+# Rough token estimates used to decide whether a batch fits one request
+BATCH_TOKEN_BUDGET = 500_000
+
+BATCH_RESULT_PATTERN = re.compile(r'<<RESULT (\d+)>>\s*(.*?)\s*<<END>>', re.DOTALL)
+
+BATCH_INSTRUCTIONS = """
+
+**BATCH MODE:**
+The input contains several independent documents. Each one starts with a
+marker line <<DOC i>> where i is its index. Classify every document on its
+own, using only that document's pages. For each document output exactly:
+<<RESULT i>>
+{{the JSON object described above for document i}}
+<<END>>
+Output one block for each of the {count} documents and nothing else.
+"""
+
 class ClassificationService:
-    def __init__(self, api_key: str, enable_dual_verification: bool = True, db = None):
-        self.gemini_primary = GeminiService(api_key, "gemini-2.5-flash")
-        self.gemini_secondary = GeminiService(api_key, "gemini-2.5-flash") if enable_dual_verification else None
+    def __init__(self, api_key: Union[str, List[str]], enable_dual_verification: bool = True, db = None,
+                 batch_mode: bool = False, max_concurrent_requests: int = 50,
+                 requests_per_minute: int = 500, key_rpm: int = DEFAULT_KEY_RPM,
+                 key_tpm: int = DEFAULT_KEY_TPM, key_rpd: int = DEFAULT_KEY_RPD):
+        # Both Gemini services draw on the same keys, so they share one pool
+        api_keys = [api_key] if isinstance(api_key, str) else list(api_key)
+        self.key_pool = GeminiKeyPool(api_keys, rpm=key_rpm, tpm=key_tpm, rpd=key_rpd)
+        self.llm_cache = LLMCache()
+        self.gemini_primary = GeminiService(model_name="gemini-2.5-flash", cache=self.llm_cache, key_pool=self.key_pool)
+        self.gemini_secondary = GeminiService(model_name="gemini-2.5-flash", cache=self.llm_cache, key_pool=self.key_pool) if enable_dual_verification else None
         self.prompt_library = PromptLibrary(db=db) # Pass Database
         self.enable_dual_verification = enable_dual_verification
+        self.db = db
+        self.batch_mode = batch_mode  # allow Gemini Batch API jobs for non-urgent work
+        
+        # Shared by every realtime Gemini call, so concurrent documents and
+        # batches stay under the account limits instead of tripping 429s
+        self._gemini_semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self._gemini_limiter = AsyncLimiter(requests_per_minute, 60)
 
     
-    async def classify_document(self, file_path: str, file_type: str) -> Dict:
+    async def classify_document(self, file_path: Union[str, BinaryIO], file_type: str,
+                                use_cache: bool = True, service_tier: Optional[str] = None) -> Dict:
         """
         Main classification workflow
+        file_path: Path on disk or a binary file object holding the document
+        use_cache: Reuse a stored result for identical content, and cached
+        Gemini responses; the fresh result is cached either way
+        service_tier: Gemini tier for the calls ("priority", "standard" or
+        "flex"); None uses the account default
         """
         try:
+            # Identical content was classified before, with the same prompts
+            # and feedback: reuse that result
+            content_hash = None
+            if self.db is not None:
+                content_hash = self._classification_cache_key(file_sha256(file_path))
+                cached = self.db.get_cached_classification(content_hash) if use_cache else None
+                if cached is not None:
+                    print("Using cached classification for identical document")
+                    return {**cached, "cached": True}
+            
             # Step 1: Preprocessing
             print("Step 1: Preprocessing document...")
             doc_info = PreprocessingService.extract_document_info(file_path, file_type)
@@ -34,93 +86,382 @@ class ClassificationService:
                     "message": "Document is not legible",
                     "pre_check": doc_info
                 }
-            
+        
+        except Exception as e:
+            print(f"❌ Error in classify_document: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return self._error_result(e)
+        
+        bypass_token = bypass_llm_cache.set(not use_cache)
+        tier_token = gemini_service_tier.set(service_tier)
+        try:
+            content = await asyncio.to_thread(self._build_content, doc_info)
+            result = await self._classify_doc_info(doc_info, content)
+        finally:
+            gemini_service_tier.reset(tier_token)
+            bypass_llm_cache.reset(bypass_token)
+        
+        if content_hash is not None and result.get("status") == "success":
+            try:
+                await asyncio.to_thread(self.db.save_cached_classification, content_hash, result)
+            except Exception as e:
+                print(f"  ⚠️ Could not cache classification: {str(e)}")
+        
+        return result
+    
+    async def _classify_doc_info(self, doc_info: Dict, content: List) -> Dict:
+        """
+        Classification workflow for an already preprocessed, legible document
+        content: The document's Gemini content items, see _build_content
+        """
+        try:
             # Step 2: Safety Check (parallel with classification)
             print("Step 2: Running safety check...")
-            safety_result = await self._safety_check(doc_info)
+            safety_task = asyncio.create_task(self._safety_check(content))
             
             # Step 3: Primary Classification
             print("Step 3: Running primary classification...")
-            primary_result = await self._primary_classification(doc_info)
+            try:
+                primary_result = await self._primary_classification(content)
+            except Exception:
+                safety_task.cancel()
+                raise
             
-            # Step 4: Dual Verification (if enabled)
-            if self.enable_dual_verification and primary_result.get("confidence", 0) < 0.9:
-                print("Step 4: Running secondary verification...")
-                secondary_result = await self._secondary_verification(doc_info, primary_result)
-                final_result = self._reconcile_classifications(primary_result, secondary_result)
-            else:
-                print("Step 4: Skipping dual verification (high confidence or disabled)...")
-                final_result = primary_result
+            # _safety_check falls back to "safe" itself, so this never raises
+            safety_result = await safety_task
             
-            # Step 5: Combine results
-            print("Step 5: Combining results...")
-            return {
-                "status": "success",
-                "pre_check": {
-                    "total_pages": doc_info["total_pages"],
-                    "total_images": doc_info["total_images"],
-                    "is_legible": doc_info["is_legible"]
-                },
-                "classification": final_result.get("classification", "Unknown"),
-                "confidence": final_result.get("confidence", 0.0),
-                "reasoning": final_result.get("detailed_reasoning", "No reasoning provided"),
-                "evidence": final_result.get("evidence", []),
-                "pii_detected": final_result.get("pii_detected", {}),
-                "safety_assessment": safety_result,
-                "requires_human_review": final_result.get("requires_human_review", False),
-                "review_reason": final_result.get("review_reason", ""),
-                "dual_verification_used": self.enable_dual_verification
-            }
+            return await self._complete_classification(doc_info, content, primary_result, safety_result)
         
         except Exception as e:
             print(f"❌ Error in classify_document: {str(e)}")
             import traceback
             traceback.print_exc()
-            return {
-                "status": "error",
-                "message": str(e),
-                "classification": "Error",
-                "confidence": 0.0,
-                "reasoning": f"Classification failed: {str(e)}",
-                "evidence": [],
-                "pii_detected": {},
-                "safety_assessment": {"is_safe": True, "child_safe": True, "violations": []},
-                "requires_human_review": True,
-                "review_reason": "Classification error occurred"
-            }
+            return self._error_result(e)
     
-    async def _primary_classification(self, doc_info: Dict) -> Dict:
+    async def classify_documents_batch(self, files: List[Tuple[Union[str, BinaryIO], str]],
+                                       service_tier: Optional[str] = None) -> List[Dict]:
         """
-        Primary classification using first LLM
+        Classify several documents with a single primary classification call
+        files: (path or binary file object, file type) pairs
+        service_tier: Gemini tier for the calls, as for classify_document
+        Returns one result per file, in order. Stored results for identical
+        content are reused as in classify_document. Safety checks and
+        secondary verification still run per document; documents that don't
+        fit the token budget, or whose result is missing from the batch
+        response, are classified one at a time.
         """
+        results: List[Optional[Dict]] = [None] * len(files)
+        
+        cache_keys = {}
+        if self.db is not None:
+            cache_keys, cached = await asyncio.to_thread(self._cached_results, files)
+            for i, result in cached.items():
+                results[i] = {**result, "cached": True}
+        
+        pending_files = {i: file for i, file in enumerate(files) if results[i] is None}
+        docs, failed = await self._preprocess_documents(pending_files)
+        for i, result in failed.items():
+            results[i] = result
+        
+        tier_token = gemini_service_tier.set(service_tier)
         try:
-            # Prepare content for Gemini
-            content = []
-            for page in doc_info["pages_content"]:
-                if page["text"] and page["text"].strip():
-                    content.append(f"[Page {page['page_number']}]\n{page['text']}")
-                if page["image"]:
-                    content.append(page["image"])
+            await self._classify_docs_batched(docs, results)
+        finally:
+            gemini_service_tier.reset(tier_token)
+        
+        for i in docs:
+            if i in cache_keys and results[i].get("status") == "success":
+                try:
+                    await asyncio.to_thread(self.db.save_cached_classification, cache_keys[i], results[i])
+                except Exception as e:
+                    print(f"  ⚠️ Could not cache classification: {str(e)}")
+        
+        return results
+    
+    def _cached_results(self, files: List[Tuple[Union[str, BinaryIO], str]]) -> Tuple[Dict[int, str], Dict[int, Dict]]:
+        """
+        Look up stored results for a list of files
+        Returns (cache key of each file that could be hashed, stored result
+        of each file that has one), both keyed by the file's index
+        """
+        cache_keys = {}
+        cached = {}
+        for i, (source, _) in enumerate(files):
+            try:
+                cache_keys[i] = self._classification_cache_key(file_sha256(source))
+            except Exception as e:
+                print(f"  ⚠️ Could not hash document {i}: {str(e)}")
+                continue
             
+            result = self.db.get_cached_classification(cache_keys[i])
+            if result is not None:
+                cached[i] = result
+        
+        return cache_keys, cached
+    
+    async def _classify_docs_batched(self, docs: Dict[int, Dict], results: List[Optional[Dict]]):
+        """Classify preprocessed documents, batching the primary call where they fit"""
+        contents = await self._build_contents(docs)
+        
+        if len(docs) > 1 and self._estimate_tokens(docs.values()) <= BATCH_TOKEN_BUDGET:
+            print(f"Running batched classification for {len(docs)} documents...")
+            safety_tasks = {i: asyncio.create_task(self._safety_check(content)) for i, content in contents.items()}
+            primary_results = await self._batch_primary_classification(contents)
+            
+            async def complete(i: int):
+                try:
+                    results[i] = await self._complete_classification(
+                        docs[i], contents[i], primary_results[i], await safety_tasks[i]
+                    )
+                except Exception as e:
+                    results[i] = self._error_result(e)
+            
+            for i in set(docs) - set(primary_results):
+                safety_tasks.pop(i).cancel()
+            await asyncio.gather(*(complete(i) for i in primary_results))
+        
+        # Anything the batch didn't cover is classified on its own
+        pending = [i for i in docs if results[i] is None]
+        per_doc = await asyncio.gather(*(self._classify_doc_info(docs[i], contents[i]) for i in pending))
+        for i, result in zip(pending, per_doc):
+            results[i] = result
+    
+    async def classify_documents_async_batch(self, files: Dict[str, Tuple[Union[str, BinaryIO], str]]) -> Dict[str, Dict]:
+        """
+        Classify a backlog of documents through the Gemini Batch API, at half
+        the cost of realtime calls but with results arriving within hours
+        files: (path or binary file object, file type) pairs keyed by an ID,
+        such as the stored file ID, that also keys the returned results
+        Primary classification and safety checks run in the batch job;
+        secondary verification of low-confidence results runs in realtime.
+        """
+        if not self.batch_mode:
+            raise RuntimeError("Batch API classification is disabled for this service")
+        
+        docs, results = await self._preprocess_documents(files)
+        if not docs:
+            return results
+        
+        contents = await self._build_contents(docs)
+        classification_prompt = self.prompt_library.get_classification_prompt()
+        safety_prompt = self.prompt_library.get_safety_check_prompt()
+        
+        items = []
+        for key, content in contents.items():
+            items.append((f"{key}:primary", classification_prompt, content))
+            items.append((f"{key}:safety", safety_prompt, content))
+        
+        print(f"Submitting {len(docs)} documents to the Gemini Batch API...")
+        try:
+            responses = await self.gemini_primary.classify_documents_batch(items)
+        except Exception as e:
+            print(f"  ❌ Batch API job failed: {str(e)}")
+            for key in docs:
+                results[key] = self._error_result(e)
+            return results
+        
+        async def complete(key: str):
+            try:
+                primary = responses.get(f"{key}:primary")
+                if not primary or not primary["success"]:
+                    error_msg = primary.get("error", "Unknown error") if primary else "missing from batch output"
+                    raise Exception(f"Classification failed: {error_msg}")
+                
+                results[key] = await self._complete_classification(
+                    docs[key],
+                    contents[key],
+                    self._primary_from_response(primary),
+                    self._safety_from_response(responses.get(f"{key}:safety"))
+                )
+            except Exception as e:
+                results[key] = self._error_result(e)
+        
+        # Secondary verification isn't urgent either
+        tier_token = gemini_service_tier.set("flex")
+        try:
+            await asyncio.gather(*(complete(key) for key in docs))
+        finally:
+            gemini_service_tier.reset(tier_token)
+        return results
+    
+    async def _preprocess_documents(self, files: Dict[Any, Tuple[Union[str, BinaryIO], str]]) -> Tuple[Dict, Dict]:
+        """
+        Preprocess several documents concurrently on worker threads
+        files: (path or binary file object, file type) pairs keyed by any ID
+        Returns (doc_info of legible documents, error results of the rest),
+        both keyed like files
+        """
+        keys = list(files)
+        outcomes = await asyncio.gather(
+            *(asyncio.to_thread(PreprocessingService.extract_document_info, *files[key]) for key in keys),
+            return_exceptions=True
+        )
+        
+        docs = {}
+        failed = {}
+        for key, doc_info in zip(keys, outcomes):
+            if isinstance(doc_info, BaseException):
+                failed[key] = self._error_result(doc_info)
+            elif not doc_info["is_legible"]:
+                failed[key] = {
+                    "status": "error",
+                    "message": "Document is not legible",
+                    "pre_check": doc_info
+                }
+            else:
+                docs[key] = doc_info
+        
+        return docs, failed
+    
+    async def _batch_primary_classification(self, contents: Dict[int, List]) -> Dict[int, Dict]:
+        """
+        Primary classification of several documents in one Gemini call,
+        returning the parsed result for each index found in the response
+        contents: Each document's content items, keyed by its index
+        """
+        content = []
+        for i, doc_content in contents.items():
+            content.append(f"<<DOC {i}>>")
+            content.extend(doc_content)
+        
+        prompt = self.prompt_library.get_classification_prompt() + BATCH_INSTRUCTIONS.format(count=len(contents))
+        result = await self._call_gemini(self.gemini_primary.classify_document, content, prompt)
+        
+        if not result["success"]:
+            print(f"  ⚠️ Batched classification failed: {result.get('error')}")
+            return {}
+        
+        parsed = {}
+        for match in BATCH_RESULT_PATTERN.finditer(result.get("raw_response", "")):
+            i = int(match.group(1))
+            if i in contents and i not in parsed:
+                parsed[i] = self._ensure_required_fields(self._parse_response_text(match.group(2)))
+        
+        print(f"  Parsed {len(parsed)}/{len(contents)} batched results")
+        return parsed
+    
+    def _classification_cache_key(self, file_hash: str) -> str:
+        """
+        Key a stored classification on the document content, the feedback
+        version and the prompts in use, so new feedback or a prompt change
+        turns an old entry into a miss
+        """
+        feedback_version = self.db.get_feedback_version()
+        prompt_digest = text_sha256(
+            self.prompt_library.get_classification_prompt() + "\0" +
+            self.prompt_library.get_safety_check_prompt()
+        )
+        return f"{file_hash}:{feedback_version}:{prompt_digest}"
+    
+    @staticmethod
+    def _build_content(doc_info: Dict) -> List:
+        """
+        Gemini content items for a preprocessed document: all page text as a
+        single string, each page labelled with its number, followed by the
+        page images in order as JPEG inline_data parts. Built once per
+        document and shared by the primary, safety and secondary calls, so
+        images are encoded (or their stored JPEG reused) only once
+        """
+        text_blob = "\n".join(
+            f"[Page {page_number}]\n{text}"
+            for page_number, text in zip(doc_info["page_numbers"], doc_info["page_texts"])
+            if text and text.strip()
+        )
+        images = [
+            PreprocessingService.encode_for_gemini(image, jpeg)
+            for image, jpeg in zip(doc_info["page_images"], doc_info["page_jpegs"])
+            if image
+        ]
+        return [text_blob, *images] if text_blob else images
+    
+    async def _build_contents(self, docs: Dict[Any, Dict]) -> Dict[Any, List]:
+        """_build_content of several documents on worker threads, keyed like docs"""
+        built = await asyncio.gather(*(asyncio.to_thread(self._build_content, doc_info) for doc_info in docs.values()))
+        return dict(zip(docs, built))
+    
+    async def _call_gemini(self, call, *args, **kwargs) -> Dict:
+        """
+        Await a realtime GeminiService call within the concurrency and
+        requests-per-minute limits
+        """
+        async with self._gemini_semaphore, self._gemini_limiter:
+            return await call(*args, **kwargs)
+    
+    @staticmethod
+    def _estimate_tokens(docs) -> int:
+        """Rough prompt size of a set of preprocessed documents"""
+        tokens = 0
+        for doc_info in docs:
+            tokens += sum(len(text or "") // CHARS_PER_TOKEN for text in doc_info["page_texts"])
+            tokens += TOKENS_PER_IMAGE * sum(1 for image in doc_info["page_images"] if image)
+        return tokens
+    
+    async def _complete_classification(self, doc_info: Dict, content: List,
+                                       primary_result: Dict, safety_result: Dict) -> Dict:
+        """
+        Run secondary verification if needed and build the final result
+        """
+        # Step 4: Dual Verification (if enabled)
+        if self.enable_dual_verification and primary_result.get("confidence", 0) < 0.9:
+            print("Step 4: Running secondary verification...")
+            secondary_result = await self._secondary_verification(content, primary_result)
+            final_result = self._reconcile_classifications(primary_result, secondary_result)
+        else:
+            print("Step 4: Skipping dual verification (high confidence or disabled)...")
+            final_result = primary_result
+        
+        # Step 5: Combine results
+        print("Step 5: Combining results...")
+        return {
+            "status": "success",
+            "pre_check": {
+                "total_pages": doc_info["total_pages"],
+                "total_images": doc_info["total_images"],
+                "is_legible": doc_info["is_legible"]
+            },
+            "classification": final_result.get("classification", "Unknown"),
+            "confidence": final_result.get("confidence", 0.0),
+            "reasoning": final_result.get("detailed_reasoning", "No reasoning provided"),
+            "evidence": final_result.get("evidence", []),
+            "pii_detected": final_result.get("pii_detected", {}),
+            "safety_assessment": safety_result,
+            "requires_human_review": final_result.get("requires_human_review", False),
+            "review_reason": final_result.get("review_reason", ""),
+            "dual_verification_used": self.enable_dual_verification
+        }
+    
+    def _error_result(self, error: Exception) -> Dict:
+        """
+        Result returned when classification of a document fails
+        """
+        return {
+            "status": "error",
+            "message": str(error),
+            "classification": "Error",
+            "confidence": 0.0,
+            "reasoning": f"Classification failed: {str(error)}",
+            "evidence": [],
+            "pii_detected": {},
+            "safety_assessment": {"is_safe": True, "child_safe": True, "violations": []},
+            "requires_human_review": True,
+            "review_reason": "Classification error occurred"
+        }
+    
+    async def _primary_classification(self, content: List) -> Dict:
+        """
+        Primary classification using first LLM
+        """
+        try:
             print(f"  Prepared {len(content)} content items for classification")
             
             prompt = self.prompt_library.get_classification_prompt()
-            result = await self.gemini_primary.classify_document(content, prompt)
+            result = await self._call_gemini(self.gemini_primary.classify_document, content, prompt, cacheable=True)
             
             print(f"  Gemini API response success: {result.get('success')}")
             
             if result["success"]:
-                classification = result["classification"]
-                
-                # Validate required fields
-                if not isinstance(classification, dict):
-                    print(f"  Warning: Expected dict, got {type(classification)}")
-                    classification = self._parse_response_text(result.get("raw_response", ""))
-                
-                # Ensure all required fields exist
-                classification = self._ensure_required_fields(classification)
-                
-                return classification
+                return self._primary_from_response(result)
             else:
                 error_msg = result.get('error', 'Unknown error')
                 print(f"  ❌ Classification API error: {error_msg}")
@@ -133,39 +474,28 @@ class ClassificationService:
             raise
     
     
-    async def _safety_check(self, doc_info: Dict) -> Dict:
+    def _primary_from_response(self, result: Dict) -> Dict:
+        """
+        Validated classification from a successful primary Gemini result
+        """
+        classification = result["classification"]
+        
+        # Validate required fields
+        if not isinstance(classification, dict):
+            print(f"  Warning: Expected dict, got {type(classification)}")
+            classification = self._parse_response_text(result.get("raw_response", ""))
+        
+        # Ensure all required fields exist
+        return self._ensure_required_fields(classification)
+    
+    async def _safety_check(self, content: List) -> Dict:
         """
         Safety assessment - separate from classification
         """
         try:
-            content = []
-            for page in doc_info["pages_content"]:
-                if page["text"] and page["text"].strip():
-                    content.append(page["text"])
-                if page["image"]:
-                    content.append(page["image"])
-            
             prompt = self.prompt_library.get_safety_check_prompt()
-            result = await self.gemini_primary.safety_check(prompt, content)
-            
-            if result["success"]:
-                safety_data = result["classification"]
-                
-                # Ensure proper structure
-                return {
-                    "is_safe": safety_data.get("is_safe", True),
-                    "child_safe": safety_data.get("child_safe", True),
-                    "violations": safety_data.get("violations", []),
-                    "confidence": safety_data.get("confidence", 0.95)
-                }
-            else:
-                # Default to safe if check fails
-                return {
-                    "is_safe": True, 
-                    "child_safe": True, 
-                    "violations": [], 
-                    "confidence": 0.5
-                }
+            result = await self._call_gemini(self.gemini_primary.safety_check, prompt, content)
+            return self._safety_from_response(result)
         except Exception as e:
             print(f"  ⚠️ Safety check failed: {str(e)}")
             # Default to safe if check fails
@@ -176,20 +506,36 @@ class ClassificationService:
                 "confidence": 0.5
             }
 
-    async def _secondary_verification(self, doc_info: Dict, primary_result: Dict) -> Dict:
+    def _safety_from_response(self, result: Optional[Dict]) -> Dict:
+        """
+        Safety assessment from a safety check Gemini result
+        """
+        if result and result["success"]:
+            safety_data = result["classification"]
+            
+            # Ensure proper structure
+            return {
+                "is_safe": safety_data.get("is_safe", True),
+                "child_safe": safety_data.get("child_safe", True),
+                "violations": safety_data.get("violations", []),
+                "confidence": safety_data.get("confidence", 0.95)
+            }
+        else:
+            # Default to safe if check fails
+            return {
+                "is_safe": True, 
+                "child_safe": True, 
+                "violations": [], 
+                "confidence": 0.5
+            }
+    
+    async def _secondary_verification(self, content: List, primary_result: Dict) -> Dict:
         """
         Secondary verification using second LLM
         """
         try:
-            content = []
-            for page in doc_info["pages_content"]:
-                if page["text"] and page["text"].strip():
-                    content.append(page["text"])
-                if page["image"]:
-                    content.append(page["image"])
-            
             prompt = self.prompt_library.get_dual_verification_prompt(primary_result)
-            result = await self.gemini_secondary.classify_document(content, prompt)
+            result = await self._call_gemini(self.gemini_secondary.classify_document, content, prompt)
             
             if result["success"]:
                 return result["classification"]
@@ -227,23 +573,22 @@ class ClassificationService:
         """
         try:
             # Try direct JSON parse first
-            return json.loads(text)
+            return orjson.loads(text)
         except:
             # Try to extract JSON from markdown code blocks
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', text, re.DOTALL)
-            if json_match:
+            body = strip_code_fence(text)
+            if body is not text:
                 try:
-                    return json.loads(json_match.group(1))
+                    return orjson.loads(body)
                 except:
                     pass
             
             # Try to find any JSON object in the text
-            json_match = re.search(r'\{.*\}', text, re.DOTALL)
-            if json_match:
+            for candidate in find_json_objects(text):
                 try:
-                    return json.loads(json_match.group(0))
+                    return orjson.loads(candidate)
                 except:
-                    pass
+                    continue
             
             # If all else fails, return a default structure
             print(f"  ⚠️ Could not parse JSON from response: {text[:200]}")
@@ -1,14 +1,105 @@
 import os
-import shutil
+import sys
+import ctypes
+import ctypes.util
 import hashlib
-from typing import Dict, Optional
+import multiprocessing
+import queue
+import sqlite3
+import struct
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, suppress
+from typing import Dict, List, Optional, Tuple, BinaryIO, Union
 from datetime import datetime, timedelta
 from PIL import Image
 import io
-import json
+import orjson
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.exceptions import InvalidTag
 from pathlib import Path
 
+# Encrypted files are a version byte followed by AES-GCM chunks of
+# nonce || ciphertext || tag. Each chunk authenticates its index and whether
+# it is the last one, so chunks can't be reordered, dropped or truncated.
+# Files written before this format are single Fernet tokens.
+ENCRYPTION_FORMAT_V1 = b'\x01'
+ENCRYPTION_CHUNK_SIZE = 1 << 20
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+# Access log entries are written by a background thread in batches of up to
+# this many lines per write
+ACCESS_LOG_BATCH_SIZE = 256
+
+# Sensitive files are overwritten once with this much random data reused
+# across the file, then their blocks are released with a punched hole
+SECURE_DELETE_CHUNK_SIZE = 1 << 20
+_FALLOC_FL_KEEP_SIZE = 0x01
+_FALLOC_FL_PUNCH_HOLE = 0x02
+
+_libc = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    except (OSError, AttributeError):
+        _libc = None
+
+THUMBNAIL_EXTENSIONS = frozenset({'pdf', 'png', 'jpg', 'jpeg'})
+THUMBNAIL_SIZE = 200
+THUMBNAIL_QUALITY = 80
+
+# Thumbnail worker processes per storage instance, i.e. per server worker.
+# They are started from a fork server: forking this multithreaded process
+# directly can leave a child stuck on a lock another thread held
+THUMBNAIL_WORKERS = 2
+
+# Columns of the files table, in the order the upsert binds them
+_FILE_COLUMNS = (
+    'file_id', 'original_filename', 'stored_filename', 'stored_path', 'thumbnail_path',
+    'classification', 'file_size', 'file_type', 'upload_timestamp', 'retention_until',
+    'encrypted', 'access_count', 'last_reclassified', 'metadata_json'
+)
+
+_SQL_UPSERT_FILE = f'''
+    INSERT INTO files ({', '.join(_FILE_COLUMNS)})
+    VALUES ({', '.join('?' for _ in _FILE_COLUMNS)})
+    ON CONFLICT(file_id) DO UPDATE
+    SET {', '.join(f'{c} = excluded.{c}' for c in _FILE_COLUMNS[1:])}
+'''
+
+_SQL_SELECT_FILE = 'SELECT * FROM files WHERE file_id = ?'
+
+_SQL_FILE_EXISTS = 'SELECT EXISTS(SELECT 1 FROM files WHERE file_id = ?)'
+
+_SQL_SELECT_HISTORY = '''
+    SELECT classification, confidence, ts AS timestamp
+    FROM classification_history
+    WHERE file_id = ?
+    ORDER BY id
+'''
+
+_SQL_INSERT_HISTORY = '''
+    INSERT INTO classification_history (file_id, classification, confidence, ts)
+    VALUES (?, ?, ?, ?)
+'''
+
+_SQL_RECLASSIFY_FILE = '''
+    UPDATE files SET classification = ?, last_reclassified = ?
+    WHERE file_id = ?
+'''
+
+_SQL_DELETE_FILE = 'DELETE FROM files WHERE file_id = ?'
+
+_SQL_DELETE_HISTORY = 'DELETE FROM classification_history WHERE file_id = ?'
+
+_SQL_SELECT_EXPIRED = 'SELECT file_id FROM files WHERE retention_until < ?'
+
 class SecureFileStorage:
     """
     Secure file storage with encryption, retention policies, and access logging
@@ -23,16 +114,47 @@ class SecureFileStorage:
         os.makedirs(self.thumbnail_dir, exist_ok=True)
         os.makedirs(self.metadata_dir, exist_ok=True)
         
+        # File metadata and reclassification history live in SQLite, so a
+        # reclassify is a row update rather than a rewrite of a JSON file
+        self.db_path = os.path.join(storage_dir, 'files.db')
+        self._db = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db_lock = threading.Lock()
+        self._init_database()
+        
+        # Access log lines are queued here and appended by a background writer
+        # with one long-lived handle, instead of an open/write/close per event
+        self._log_queue = queue.SimpleQueue()
+        self._log_fh = open(os.path.join(storage_dir, 'access_log.jsonl'), 'ab', buffering=1 << 16)
+        self._log_thread = threading.Thread(target=self._log_flusher, name='access-log', daemon=True)
+        self._log_thread.start()
+        
+        # Rasterizing and resizing hold the GIL, so thumbnails are rendered in
+        # worker processes rather than on the storage threads. The pool is
+        # started on the first thumbnail, not when the API module is imported
+        self._thumb_pool = None
+        self._thumb_pool_lock = threading.Lock()
+        
         # Initialize encryption
         if encryption_key:
             self.cipher = Fernet(encryption_key.encode())
             self.encryption_enabled = True
         else:
             # Generate a key for this session
-            key = Fernet.generate_key()
-            self.cipher = Fernet(key)
+            encryption_key = Fernet.generate_key().decode()
+            self.cipher = Fernet(encryption_key.encode())
             self.encryption_enabled = False
             print("⚠️ Warning: Using session-only encryption key")
+        
+        # Fernet stays for decrypting older files; new files use AES-GCM with
+        # a key derived from the same secret
+        self._aes_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'secure-file-storage/aes-256-gcm'
+        ).derive(encryption_key.encode())
+        self.aesgcm = AESGCM(self._aes_key)
     
     def store_file(self, source_path: str, filename: str, classification: str, 
                    metadata: Dict) -> Dict:
@@ -40,53 +162,57 @@ class SecureFileStorage:
         Securely store a file with metadata and thumbnail
         """
         try:
-            # Generate unique file ID
-            file_hash = self._generate_file_hash(source_path)
-            file_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file_hash[:8]}"
-            
-            # Determine file extension
             ext = filename.split('.')[-1].lower()
-            stored_filename = f"{file_id}.{ext}"
-            stored_path = os.path.join(self.storage_dir, stored_filename)
+            encrypt = self.encryption_enabled and classification in ['Highly Sensitive', 'Confidential']
             
-            # Copy or encrypt file
-            if self.encryption_enabled and classification in ['Highly Sensitive', 'Confidential']:
-                self._encrypt_file(source_path, stored_path)
-            else:
-                shutil.copy2(source_path, stored_path)
+            # Hash and copy (or encrypt) in a single read of the source
+            with open(source_path, 'rb') as src:
+                file_id, stored_path, file_size = self._hash_and_store(src, ext, encrypt)
             
             # Create thumbnail if image or PDF
-            thumbnail_path = self._create_thumbnail(source_path, file_id, ext)
+            thumbnail_path = self._create_thumbnail(stored_path, encrypt, file_id, ext)
             
-            # Store metadata
-            file_metadata = {
-                'file_id': file_id,
-                'original_filename': filename,
-                'stored_filename': stored_filename,
-                'stored_path': stored_path,
-                'thumbnail_path': thumbnail_path,
-                'classification': classification,
-                'file_size': os.path.getsize(source_path),
-                'file_type': ext,
-                'upload_timestamp': datetime.now().isoformat(),
-                'retention_until': (datetime.now() + timedelta(days=90)).isoformat(),
-                'encrypted': self.encryption_enabled and classification in ['Highly Sensitive', 'Confidential'],
-                'access_count': 0,
-                'metadata': metadata
+            return self._save_metadata(
+                file_id=file_id,
+                filename=filename,
+                stored_path=stored_path,
+                thumbnail_path=thumbnail_path,
+                classification=classification,
+                file_size=file_size,
+                metadata=metadata
+            )
+        
+        except Exception as e:
+            print(f"Error storing file: {e}")
+            return {
+                'success': False,
+                'error': str(e)
             }
+    
+    def store_stream(self, fileobj: BinaryIO, filename: str, classification: str,
+                     metadata: Dict) -> Dict:
+        """
+        Securely store an uploaded stream without an intermediate temp copy,
+        hashing it in the same pass that writes it to storage
+        """
+        try:
+            ext = filename.split('.')[-1].lower()
+            encrypt = self.encryption_enabled and classification in ['Highly Sensitive', 'Confidential']
             
-            # Save metadata
-            metadata_path = os.path.join(self.metadata_dir, f"{file_id}.json")
-            with open(metadata_path, 'w') as f:
-                json.dump(file_metadata, f, indent=2)
+            file_id, stored_path, file_size = self._hash_and_store(fileobj, ext, encrypt)
             
-            return {
-                'success': True,
-                'file_id': file_id,
-                'stored_path': stored_path,
-                'thumbnail_path': thumbnail_path,
-                'metadata': file_metadata
-            }
+            # Create thumbnail from the stored copy
+            thumbnail_path = self._create_thumbnail(stored_path, encrypt, file_id, ext)
+            
+            return self._save_metadata(
+                file_id=file_id,
+                filename=filename,
+                stored_path=stored_path,
+                thumbnail_path=thumbnail_path,
+                classification=classification,
+                file_size=file_size,
+                metadata=metadata
+            )
         
         except Exception as e:
             print(f"Error storing file: {e}")
@@ -95,6 +221,70 @@ class SecureFileStorage:
                 'error': str(e)
             }
     
+    def _hash_and_store(self, src: BinaryIO, ext: str, encrypt: bool) -> Tuple[str, str, int]:
+        """
+        Write src into storage (encrypted if requested) while hashing it in
+        the same pass. Returns the file ID, stored path and plaintext size
+        """
+        sha256 = hashlib.sha256()
+        file_size = 0
+        
+        # The file ID comes from the hash, so write under a temporary name first
+        fd, temp_path = tempfile.mkstemp(dir=self.storage_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                writer = _ChunkedEncryptor(self.aesgcm, out) if encrypt else out
+                for chunk in iter(lambda: src.read(ENCRYPTION_CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+                    file_size += len(chunk)
+                    writer.write(chunk)
+                
+                if encrypt:
+                    writer.close()
+            
+            file_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{sha256.hexdigest()[:8]}"
+            stored_path = os.path.join(self.storage_dir, f"{file_id}.{ext}")
+            os.replace(temp_path, stored_path)
+            temp_path = None
+            
+            return file_id, stored_path, file_size
+        
+        finally:
+            if temp_path:
+                with suppress(FileNotFoundError):
+                    os.remove(temp_path)
+    
+    def _save_metadata(self, file_id: str, filename: str, stored_path: str,
+                       thumbnail_path: Optional[str], classification: str,
+                       file_size: int, metadata: Dict) -> Dict:
+        """Write the metadata record for a newly stored file"""
+        file_metadata = {
+            'file_id': file_id,
+            'original_filename': filename,
+            'stored_filename': os.path.basename(stored_path),
+            'stored_path': stored_path,
+            'thumbnail_path': thumbnail_path,
+            'classification': classification,
+            'file_size': file_size,
+            'file_type': filename.split('.')[-1].lower(),
+            'upload_timestamp': datetime.now().isoformat(),
+            'retention_until': (datetime.now() + timedelta(days=90)).isoformat(),
+            'encrypted': self.encryption_enabled and classification in ['Highly Sensitive', 'Confidential'],
+            'access_count': 0,
+            'metadata': metadata
+        }
+        
+        # Save metadata
+        self._write_metadata(file_id, file_metadata)
+        
+        return {
+            'success': True,
+            'file_id': file_id,
+            'stored_path': stored_path,
+            'thumbnail_path': thumbnail_path,
+            'metadata': file_metadata
+        }
+    
     def retrieve_file(self, file_id: str) -> Optional[str]:
         """
         Retrieve a file by ID, decrypt if necessary
@@ -126,6 +316,26 @@ class SecureFileStorage:
         """Get file metadata"""
         return self._load_metadata(file_id)
     
+    def update_metadata(self, file_id: str, metadata: Dict):
+        """
+        Persist an updated metadata record. The classification history is
+        kept separately, see record_reclassification
+        """
+        self._write_metadata(file_id, metadata)
+    
+    def record_reclassification(self, file_id: str, classification: str,
+                                confidence: Optional[float]) -> Optional[Dict]:
+        """Set a file's new classification and append it to its history"""
+        timestamp = datetime.now().isoformat()
+        
+        with self._transaction() as cursor:
+            cursor.execute(_SQL_RECLASSIFY_FILE, (classification, timestamp, file_id))
+            if cursor.rowcount == 0:
+                return None
+            cursor.execute(_SQL_INSERT_HISTORY, (file_id, classification, confidence, timestamp))
+        
+        return self._load_metadata(file_id)
+    
     def delete_file(self, file_id: str, reason: str = "manual") -> bool:
         """
         Securely delete a file and its metadata
@@ -142,15 +352,18 @@ class SecureFileStorage:
             if metadata['classification'] in ['Highly Sensitive', 'Confidential']:
                 self._secure_delete(metadata['stored_path'])
             else:
-                os.remove(metadata['stored_path'])
+                with suppress(FileNotFoundError):
+                    os.remove(metadata['stored_path'])
             
             # Delete thumbnail
-            if metadata.get('thumbnail_path') and os.path.exists(metadata['thumbnail_path']):
-                os.remove(metadata['thumbnail_path'])
+            if metadata.get('thumbnail_path'):
+                with suppress(FileNotFoundError):
+                    os.remove(metadata['thumbnail_path'])
             
             # Delete metadata
-            metadata_path = os.path.join(self.metadata_dir, f"{file_id}.json")
-            os.remove(metadata_path)
+            with self._transaction() as cursor:
+                cursor.execute(_SQL_DELETE_FILE, (file_id,))
+                cursor.execute(_SQL_DELETE_HISTORY, (file_id,))
             
             return True
         
@@ -165,87 +378,197 @@ class SecureFileStorage:
         deleted_count = 0
         errors = []
         
-        for metadata_file in os.listdir(self.metadata_dir):
-            if not metadata_file.endswith('.json'):
-                continue
-            
-            file_id = metadata_file.replace('.json', '')
-            metadata = self._load_metadata(file_id)
-            
-            if metadata and metadata.get('retention_until'):
-                retention_date = datetime.fromisoformat(metadata['retention_until'])
-                if datetime.now() > retention_date:
-                    if self.delete_file(file_id, reason="retention_policy"):
-                        deleted_count += 1
-                    else:
-                        errors.append(file_id)
+        # ISO timestamps sort chronologically, so this is an index range scan
+        with self._db_lock:
+            rows = self._db.execute(_SQL_SELECT_EXPIRED, (datetime.now().isoformat(),)).fetchall()
+        
+        for (file_id,) in rows:
+            if self.delete_file(file_id, reason="retention_policy"):
+                deleted_count += 1
+            else:
+                errors.append(file_id)
         
         return {
             'deleted_count': deleted_count,
             'errors': errors
         }
     
-    def _generate_file_hash(self, file_path: str) -> str:
-        """Generate SHA-256 hash of file"""
-        sha256 = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256.update(chunk)
-        return sha256.hexdigest()
-    
-    def _encrypt_file(self, source_path: str, dest_path: str):
-        """Encrypt file using Fernet"""
-        with open(source_path, 'rb') as f:
-            data = f.read()
-        
-        encrypted_data = self.cipher.encrypt(data)
-        
-        with open(dest_path, 'wb') as f:
-            f.write(encrypted_data)
-    
     def _decrypt_file(self, source_path: str, dest_path: str):
-        """Decrypt file using Fernet"""
-        with open(source_path, 'rb') as f:
-            encrypted_data = f.read()
-        
-        decrypted_data = self.cipher.decrypt(encrypted_data)
-        
-        with open(dest_path, 'wb') as f:
-            f.write(decrypted_data)
+        """Decrypt a chunked AES-GCM file, or a legacy Fernet token"""
+        with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
+            if src.read(1) != ENCRYPTION_FORMAT_V1:
+                src.seek(0)
+                dst.write(self.cipher.decrypt(src.read()))
+                return
+            
+            for chunk in _decrypt_chunks(src, self.aesgcm):
+                dst.write(chunk)
     
-    def _create_thumbnail(self, source_path: str, file_id: str, ext: str) -> Optional[str]:
-        """Create thumbnail for preview"""
+    def _create_thumbnail(self, stored_path: str, encrypted: bool, file_id: str, ext: str) -> Optional[str]:
+        """
+        Queue a preview thumbnail of a stored file on the thumbnail process
+        pool and return the path it will be written to. Only the path (and
+        the key, for encrypted files) is sent to the worker, and the calling
+        storage thread doesn't wait for the render
+        """
+        if ext not in THUMBNAIL_EXTENSIONS:
+            return None
+        
         try:
-            if ext == 'pdf':
-                import fitz
-                doc = fitz.open(source_path)
-                page = doc[0]
-                pix = page.get_pixmap(matrix=fitz.Matrix(0.3, 0.3))
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            elif ext in ['png', 'jpg', 'jpeg']:
-                img = Image.open(source_path)
-            else:
-                return None
-            
-            # Resize to thumbnail
-            img.thumbnail((200, 200))
-            thumbnail_path = os.path.join(self.thumbnail_dir, f"{file_id}_thumb.png")
-            img.save(thumbnail_path, "PNG")
-            
+            thumbnail_path = os.path.join(self.thumbnail_dir, f"{file_id}_thumb.jpg")
+            future = self._thumbnail_pool().submit(
+                _render_thumbnail, stored_path, ext, thumbnail_path,
+                self._aes_key if encrypted else None
+            )
+            future.add_done_callback(_report_thumbnail_error)
             return thumbnail_path
         
         except Exception as e:
             print(f"Could not create thumbnail: {e}")
             return None
     
+    def _thumbnail_pool(self) -> ProcessPoolExecutor:
+        """The thumbnail process pool, started on first use"""
+        with self._thumb_pool_lock:
+            if self._thumb_pool is None:
+                mp_context = multiprocessing.get_context('forkserver')
+                mp_context.set_forkserver_preload([__name__])
+                self._thumb_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS, mp_context=mp_context)
+            return self._thumb_pool
+    
+    def _init_database(self):
+        """Create the metadata tables and import any legacy JSON metadata"""
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA busy_timeout=5000')
+        
+        # Immediate, so workers starting together import legacy files once
+        with self._transaction(immediate=True) as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT PRIMARY KEY,
+                    original_filename TEXT,
+                    stored_filename TEXT,
+                    stored_path TEXT,
+                    thumbnail_path TEXT,
+                    classification TEXT,
+                    file_size INTEGER,
+                    file_type TEXT,
+                    upload_timestamp TEXT,
+                    retention_until TEXT,
+                    encrypted INTEGER DEFAULT 0,
+                    access_count INTEGER DEFAULT 0,
+                    last_reclassified TEXT,
+                    metadata_json TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS classification_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_id TEXT NOT NULL,
+                    classification TEXT,
+                    confidence REAL,
+                    ts TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_history_file
+                ON classification_history(file_id)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_files_retention
+                ON files(retention_until)
+            ''')
+            
+            # Metadata used to be one JSON file per stored file
+            imported = []
+            for metadata_file in os.listdir(self.metadata_dir):
+                if not metadata_file.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.metadata_dir, metadata_file), 'rb') as f:
+                        metadata = orjson.loads(f.read())
+                except FileNotFoundError:
+                    continue
+                
+                imported.append(metadata_file)
+                cursor.execute(_SQL_FILE_EXISTS, (metadata['file_id'],))
+                if cursor.fetchone()[0]:
+                    continue
+                
+                cursor.execute(_SQL_UPSERT_FILE, self._file_row(metadata))
+                cursor.executemany(_SQL_INSERT_HISTORY, [
+                    (metadata['file_id'], entry.get('classification'),
+                     entry.get('confidence'), entry.get('timestamp'))
+                    for entry in metadata.get('classification_history', [])
+                ])
+        
+        for metadata_file in imported:
+            try:
+                os.remove(os.path.join(self.metadata_dir, metadata_file))
+            except FileNotFoundError:
+                pass
+    
+    @contextmanager
+    def _transaction(self, immediate: bool = False):
+        """Yield a cursor on the metadata database inside a transaction"""
+        with self._db_lock:
+            cursor = self._db.cursor()
+            cursor.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            try:
+                yield cursor
+            except Exception:
+                self._db.rollback()
+                raise
+            else:
+                self._db.commit()
+            finally:
+                cursor.close()
+    
+    def _file_row(self, metadata: Dict) -> tuple:
+        """Build the files upsert parameters for a metadata record"""
+        return (
+            metadata['file_id'],
+            metadata.get('original_filename'),
+            metadata.get('stored_filename'),
+            metadata.get('stored_path'),
+            metadata.get('thumbnail_path'),
+            metadata.get('classification'),
+            metadata.get('file_size'),
+            metadata.get('file_type'),
+            metadata.get('upload_timestamp'),
+            metadata.get('retention_until'),
+            int(bool(metadata.get('encrypted'))),
+            metadata.get('access_count', 0),
+            metadata.get('last_reclassified'),
+            orjson.dumps(metadata.get('metadata', {}), default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        )
+    
     def _load_metadata(self, file_id: str) -> Optional[Dict]:
         """Load file metadata"""
-        metadata_path = os.path.join(self.metadata_dir, f"{file_id}.json")
-        if not os.path.exists(metadata_path):
-            return None
+        # Deliberately not cached in-process: each worker would keep serving
+        # its own copy after another worker reclassified or deleted the file,
+        # and a primary-key lookup in SQLite is already cheap
+        with self._db_lock:
+            row = self._db.execute(_SQL_SELECT_FILE, (file_id,)).fetchone()
+            if not row:
+                return None
+            history = self._db.execute(_SQL_SELECT_HISTORY, (file_id,)).fetchall()
         
-        with open(metadata_path, 'r') as f:
-            return json.load(f)
+        metadata = dict(row)
+        metadata['encrypted'] = bool(metadata['encrypted'])
+        metadata['metadata'] = orjson.loads(metadata.pop('metadata_json') or '{}')
+        if metadata['last_reclassified'] is None:
+            del metadata['last_reclassified']
+        if history:
+            metadata['classification_history'] = [dict(entry) for entry in history]
+        
+        return metadata
+    
+    def _write_metadata(self, file_id: str, metadata: Dict):
+        """Write file metadata to the database"""
+        with self._transaction() as cursor:
+            cursor.execute(_SQL_UPSERT_FILE, self._file_row({**metadata, 'file_id': file_id}))
     
     def _log_file_access(self, file_id: str, action: str, details: str = ""):
         """Log file access for audit"""
@@ -256,22 +579,152 @@ class SecureFileStorage:
             'timestamp': datetime.now().isoformat()
         }
         
-        log_file = os.path.join(self.storage_dir, 'access_log.jsonl')
-        with open(log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
+        self._log_queue.put(log_entry)
+    
+    def _log_flusher(self):
+        """Append queued access log entries, draining up to a batch per write"""
+        while True:
+            batch = [self._log_queue.get()]
+            while len(batch) < ACCESS_LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = None in batch
+            self._log_fh.write(b''.join(orjson.dumps(e) + b'\n' for e in batch if e is not None))
+            self._log_fh.flush()
+            if stop:
+                return
+    
+    def close(self):
+        """Flush pending access log entries and close the storage handles"""
+        self._log_queue.put(None)
+        self._log_thread.join()
+        self._log_fh.close()
+        with self._thumb_pool_lock:
+            if self._thumb_pool is not None:
+                self._thumb_pool.shutdown()
+        with self._db_lock:
+            self._db.close()
     
     def _secure_delete(self, file_path: str):
-        """Securely delete sensitive files by overwriting"""
-        if not os.path.exists(file_path):
+        """Securely delete sensitive files by overwriting, then discarding their blocks"""
+        try:
+            f = open(file_path, 'r+b')
+        except FileNotFoundError:
             return
         
-        file_size = os.path.getsize(file_path)
-        
-        # Overwrite with random data 3 times
-        with open(file_path, 'wb') as f:
-            for _ in range(3):
-                f.write(os.urandom(file_size))
-                f.seek(0)
+        with f:
+            file_size = os.fstat(f.fileno()).st_size
+            
+            # Overwrite in place with random data, one pass
+            noise = memoryview(os.urandom(min(file_size, SECURE_DELETE_CHUNK_SIZE)))
+            remaining = file_size
+            while remaining > 0:
+                remaining -= f.write(noise[:remaining])
+            f.flush()
+            os.fsync(f.fileno())
+            
+            # On SSDs and copy-on-write filesystems the overwrite may land on
+            # new blocks, so also tell the filesystem to discard the old ones
+            _punch_hole(f.fileno(), file_size)
         
         # Finally delete
-        os.remove(file_path)
\ No newline at end of file
+        os.remove(file_path)
+
+def _punch_hole(fd: int, length: int):
+    """Deallocate a file's blocks where the OS and filesystem support it"""
+    if _libc is not None and length:
+        # Best effort: filesystems without hole punching return EOPNOTSUPP
+        _libc.fallocate(fd, _FALLOC_FL_PUNCH_HOLE | _FALLOC_FL_KEEP_SIZE, 0, length)
+
+def _report_thumbnail_error(future):
+    """Log a thumbnail render that failed in the worker process"""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Could not create thumbnail: {future.exception()}")
+
+def _render_thumbnail(stored_path: str, ext: str, thumbnail_path: str,
+                      aes_key: Optional[bytes] = None) -> str:
+    """
+    Render a thumbnail of an image or a PDF's first page (runs in a worker
+    process). Encrypted files are decrypted in memory with aes_key
+    """
+    source = stored_path
+    if aes_key is not None:
+        with open(stored_path, 'rb') as src:
+            src.read(len(ENCRYPTION_FORMAT_V1))
+            source = b"".join(_decrypt_chunks(src, AESGCM(aes_key)))
+    
+    if ext == 'pdf':
+        import fitz
+        if isinstance(source, bytes):
+            doc = fitz.open(stream=source, filetype="pdf")
+        else:
+            doc = fitz.open(source)
+        page = doc[0]
+        
+        # Rasterize straight at thumbnail size instead of resampling afterwards
+        zoom = THUMBNAIL_SIZE / max(page.rect.width, page.rect.height)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    else:
+        img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        
+        # Resize to thumbnail
+        img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    
+    img.save(thumbnail_path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    
+    return thumbnail_path
+
+def _decrypt_chunks(src: BinaryIO, aesgcm: AESGCM):
+    """Yield the plaintext chunks of an AES-GCM file, read past its version byte"""
+    block_size = NONCE_SIZE + ENCRYPTION_CHUNK_SIZE + TAG_SIZE
+    index = 0
+    block = src.read(block_size)
+    while True:
+        if len(block) < NONCE_SIZE + TAG_SIZE:
+            raise InvalidTag("Encrypted file is truncated")
+        
+        next_block = src.read(block_size) if len(block) == block_size else b""
+        last = not next_block
+        yield aesgcm.decrypt(block[:NONCE_SIZE], block[NONCE_SIZE:], _chunk_aad(index, last))
+        
+        if last:
+            break
+        block = next_block
+        index += 1
+
+def _chunk_aad(index: int, last: bool) -> bytes:
+    """Associated data binding an encrypted chunk to its position"""
+    return struct.pack('>QB', index, last)
+
+class _ChunkedEncryptor:
+    """
+    File-like writer that AES-GCM encrypts data in fixed-size chunks. One
+    full chunk is held back so the final chunk can be marked as such.
+    """
+    def __init__(self, aesgcm: AESGCM, out: BinaryIO):
+        self.aesgcm = aesgcm
+        self.out = out
+        self.buffer = bytearray()
+        self.index = 0
+        out.write(ENCRYPTION_FORMAT_V1)
+    
+    def write(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) > ENCRYPTION_CHUNK_SIZE:
+            self._write_chunk(bytes(self.buffer[:ENCRYPTION_CHUNK_SIZE]), last=False)
+            del self.buffer[:ENCRYPTION_CHUNK_SIZE]
+    
+    def close(self):
+        self._write_chunk(bytes(self.buffer), last=True)
+        self.buffer.clear()
+    
+    def _write_chunk(self, chunk: bytes, last: bool):
+        nonce = os.urandom(NONCE_SIZE)
+        self.out.write(nonce + self.aesgcm.encrypt(nonce, chunk, _chunk_aad(self.index, last)))
+        self.index += 1
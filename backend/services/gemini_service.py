@@ -1,14 +1,76 @@
-import google.generativeai as genai
-from typing import List, Dict, Any
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Tuple
+from services.key_pool import GeminiKeyPool, PooledKey
+from services.preprocessing import PreprocessingService
+from utils.hashing import text_sha256
+from utils.llm_cache import LLMCache, bypass_llm_cache
+from utils.json_extract import strip_code_fence, find_json_objects, salvage_truncated_object
+import asyncio
+import base64
 import json
+import orjson
+import os
+import tempfile
+import time
 from PIL import Image
-import io
-import re
+
+GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+}
+
+# Service tier for realtime calls made in the current context: "priority"
+# for someone waiting on the result, "flex" (half price, may queue) for
+# background work, None for the account default (standard)
+gemini_service_tier: ContextVar[Optional[str]] = ContextVar("gemini_service_tier", default=None)
+
+# Rough token estimates for request sizes
+CHARS_PER_TOKEN = 4
+TOKENS_PER_IMAGE = 258
+
+# A throttled request is retried on another key up to this many times
+MAX_RATE_LIMIT_RETRIES = 4
+RATE_LIMIT_CODES = frozenset({429, 403})
+
+# Cacheable prompts (the fixed classification and safety prompts, not ones
+# built per document) of at least this many tokens (estimated at 4 characters
+# each, the Gemini minimum for explicit caching) are uploaded once as cached
+# content and referenced by name, instead of being resent with every document
+CONTEXT_CACHE_MIN_TOKENS = 1024
+CONTEXT_CACHE_TTL = 3600
+
+# Batch API jobs complete within 24 hours; their state is polled this often
+BATCH_POLL_INTERVAL = 60
+BATCH_DONE_STATES = frozenset({
+    "JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"
+})
+
+# Keyword rules for responses that aren't JSON, checked against the
+# lowercased text; the first matching classification wins
+FALLBACK_CLASSIFICATION_KEYWORDS = (
+    ("Highly Sensitive", ("highly sensitive", "ssn", "social security", "classified")),
+    ("Confidential", ("confidential", "internal", "private")),
+    ("Unsafe", ("unsafe", "inappropriate", "explicit")),
+)
+FALLBACK_PII_KEYWORDS = {
+    "ssn": ("ssn", "social security"),
+    "credit_card": ("credit card",),
+    "account_numbers": ("account",),
+}
 
 class GeminiService:
-    def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash"):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name)
+    def __init__(self, api_key: Optional[str] = None, model_name: str = "gemini-2.5-flash",
+                 cache: Optional[LLMCache] = None, key_pool: Optional[GeminiKeyPool] = None):
+        """
+        Pass either a single api_key or a key_pool to spread calls over
+        several keys; services sharing keys should share the pool
+        """
+        self.key_pool = key_pool or GeminiKeyPool([api_key])
+        self.client = self.key_pool.keys[0].client  # Batch API and file uploads
+        self.model_name = model_name
+        self.cache = cache
         self.safety_settings = [
             {
                 "category": "HARM_CATEGORY_HARASSMENT",
@@ -27,42 +89,57 @@ class GeminiService:
                 "threshold": "BLOCK_NONE"
             }
         ]
+        self.request_config = {**GENERATION_CONFIG, "safety_settings": self.safety_settings}
     
-    async def classify_document(self, content: List[Any], prompt: str) -> Dict:
+    async def classify_document(self, content: List[Any], prompt: str, cacheable: bool = False) -> Dict:
         """
         Classify document using Gemini API
-        content: List of text strings and/or PIL Images
+        content: List of text strings, PIL Images and/or inline_data parts
+        cacheable: The prompt is shared by many documents, so it may be kept
+        as Gemini cached content; never set for per-document prompts
         """
         try:
+            # Identical requests (same model, prompt, pages and settings)
+            # return the stored response
+            cache_key = None
+            if self.cache is not None and not bypass_llm_cache.get():
+                cache_key = await asyncio.to_thread(
+                    self.cache.make_key, self.model_name, prompt, content, self.request_config
+                )
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    print(f"    Using cached Gemini response")
+                    return cached
+            
             print(f"    Sending request to Gemini API...")
             print(f"    Content items: {len(content)}")
             
-            response = self.model.generate_content(
-                [prompt] + content,
-                safety_settings=self.safety_settings,
-                generation_config={
-                    "temperature": 0.1,
-                    "top_p": 0.95,
-                    "top_k": 40,
-                    "max_output_tokens": 8192,
-                }
-            )
+            response = await self._generate(content, prompt, cacheable)
             
             print(f"    ✓ Received response from Gemini")
             
-            # Get the text response
+            # Get the text response (None when the response was blocked)
             response_text = response.text
+            if response_text is None:
+                raise Exception("Response was blocked or returned no text")
             print(f"    Response length: {len(response_text)} characters")
             
-            # Try to parse JSON from the response
-            result = self._parse_json_response(response_text)
+            # Try to parse JSON from the response; a response cut off at the
+            # output token limit keeps whatever fields were complete
+            candidates = response.candidates or []
+            truncated = bool(candidates) and candidates[0].finish_reason == "MAX_TOKENS"
+            result = self._parse_json_response(response_text, truncated)
             
-            return {
+            output = {
                 "success": True,
                 "classification": result,
                 "raw_response": response_text
             }
+            if cache_key is not None:
+                self.cache.set(cache_key, output)
             
+            return output
+        
         except Exception as e:
             error_message = str(e)
             print(f"    ❌ Gemini API Error: {error_message}")
@@ -81,38 +158,250 @@ class GeminiService:
                 "classification": self._create_error_classification(error_message)
             }
     
+    async def _generate(self, content: List[Any], prompt: str, cacheable: bool = False):
+        """
+        generate_content on a pooled key, moving to another key with
+        exponential backoff when one is rate limited
+        """
+        tokens = len(prompt) // CHARS_PER_TOKEN
+        for item in content:
+            tokens += TOKENS_PER_IMAGE if isinstance(item, (Image.Image, dict)) else len(str(item)) // CHARS_PER_TOKEN
+        
+        if any(isinstance(item, Image.Image) for item in content):
+            content = await asyncio.to_thread(self._encode_images, content)
+        service_tier = gemini_service_tier.get()
+        
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            key = await self.key_pool.acquire(tokens)
+            
+            cached_prompt = await self.ensure_cached_prompt(prompt, key) if cacheable and content else None
+            if cached_prompt:
+                contents = content
+                config = {**self.request_config, "cached_content": cached_prompt}
+            else:
+                contents = [prompt] + content
+                config = self.request_config
+            if service_tier:
+                config = {**config, "service_tier": service_tier}
+            
+            try:
+                response = await key.client.aio.models.generate_content(
+                    model=self.model_name,
+                    contents=contents,
+                    config=config
+                )
+            except Exception as e:
+                if getattr(e, "code", None) not in RATE_LIMIT_CODES or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                
+                self.key_pool.mark_rate_limited(key)
+                print(f"    ⚠️ API key {key.index} was rate limited, retrying on another key")
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            
+            # Priority requests over the priority limit are served at
+            # standard instead; that's still a valid result, so don't retry
+            served_tier = getattr(response.usage_metadata, "service_tier", None)
+            if service_tier == "priority" and served_tier is not None and served_tier != "priority":
+                print(f"    ℹ️ Priority request was served at the {served_tier} tier")
+            return response
+    
+    async def ensure_cached_prompt(self, prompt: str, key: PooledKey) -> Optional[str]:
+        """
+        Name of a Gemini cached-content entry holding prompt under the given
+        key, created on first use and renewed before it expires. A changed
+        prompt (e.g. after new HITL patterns) hashes differently and gets its
+        own entry, so only call this for prompts shared across documents.
+        Returns None for prompts below the caching minimum or when creation
+        fails.
+        """
+        if len(prompt) // CHARS_PER_TOKEN < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+        
+        prompt_hash = text_sha256(prompt)
+        entry = key.prompt_caches.get(prompt_hash)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        
+        async with key.prompt_cache_lock:
+            now = time.monotonic()
+            entry = key.prompt_caches.get(prompt_hash)
+            if entry and entry[1] > now:
+                return entry[0]
+            
+            try:
+                cache = await key.client.aio.caches.create(
+                    model=self.model_name,
+                    config={
+                        "contents": [prompt],
+                        "ttl": f"{CONTEXT_CACHE_TTL}s",
+                        "display_name": f"prompt-{prompt_hash[:16]}"
+                    }
+                )
+                name = cache.name
+                print(f"    Cached prompt prefix as {name}")
+            except Exception as e:
+                print(f"    ⚠️ Could not cache prompt prefix: {str(e)}")
+                name = None
+            
+            # Drop expired entries; renew a minute before the server expires
+            # ours (a failed attempt is retried after the same interval)
+            key.prompt_caches = {k: v for k, v in key.prompt_caches.items() if v[1] > now}
+            key.prompt_caches[prompt_hash] = (name, now + CONTEXT_CACHE_TTL - 60)
+            return name
+    
     async def safety_check(self, prompt: str, content: List[Any]) -> Dict:
         """
-        Dedicated safety check for content
+        Dedicated safety check for content; the safety prompt is the same for
+        every document, so it may be served from cached content
         """
         safety_prompt = prompt
         
-        return await self.classify_document(content, safety_prompt)
+        return await self.classify_document(content, safety_prompt, cacheable=True)
     
-    def _parse_json_response(self, response_text: str) -> Dict:
+    async def classify_documents_batch(self, items: List[Tuple[str, str, List[Any]]]) -> Dict[str, Dict]:
+        """
+        Classify documents through the Gemini Batch API, billed at half the
+        realtime price but completing asynchronously, possibly hours later
+        items: (key, prompt, content) for each request; keys must be unique
+        Returns a classify_document-style result for each key in the output
+        """
+        client = self.client
+        
+        # Requests go up as a JSONL file, one {"key", "request"} per line
+        fd, jsonl_path = tempfile.mkstemp(suffix=".jsonl")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for key, prompt, content in items:
+                    f.write(json.dumps({"key": key, "request": self._batch_request(content, prompt)}) + "\n")
+            
+            uploaded = await asyncio.to_thread(
+                client.files.upload,
+                file=jsonl_path,
+                config={"display_name": os.path.basename(jsonl_path), "mime_type": "jsonl"}
+            )
+        finally:
+            os.remove(jsonl_path)
+        
+        job = await asyncio.to_thread(
+            client.batches.create,
+            model=self.model_name,
+            src={"file_name": uploaded.name},
+            config={"display_name": f"classification-{len(items)}-requests"}
+        )
+        print(f"    Submitted Gemini batch job {job.name} ({len(items)} requests)")
+        
+        while job.state.name not in BATCH_DONE_STATES:
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            job = await asyncio.to_thread(client.batches.get, name=job.name)
+        
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            raise Exception(f"Batch job {job.name} ended in {job.state.name}: {job.error}")
+        
+        output = await asyncio.to_thread(client.files.download, file=job.dest.file_name)
+        
+        results = {}
+        for line in output.splitlines():
+            if line.strip():
+                entry = orjson.loads(line)
+                results[entry["key"]] = self._batch_result(entry)
+        
+        print(f"    ✓ Batch job {job.name} returned {len(results)} results")
+        return results
+    
+    @staticmethod
+    def _encode_images(content: List[Any]) -> List[Any]:
+        """Content with PIL images replaced by compact JPEG inline_data parts"""
+        return [
+            PreprocessingService.encode_for_gemini(item) if isinstance(item, Image.Image) else item
+            for item in content
+        ]
+    
+    def _batch_request(self, content: List[Any], prompt: str) -> Dict:
+        """
+        GenerateContentRequest JSON for one batch line; images are sent
+        inline as base64 JPEG
+        """
+        parts = [{"text": prompt}]
+        for item in content:
+            if isinstance(item, (Image.Image, dict)):
+                part = item if isinstance(item, dict) else PreprocessingService.encode_for_gemini(item)
+                blob = part["inline_data"]
+                parts.append({"inline_data": {
+                    "mime_type": blob["mime_type"],
+                    "data": base64.b64encode(blob["data"]).decode()
+                }})
+            else:
+                parts.append({"text": str(item)})
+        
+        return {
+            "contents": [{"role": "user", "parts": parts}],
+            "generation_config": GENERATION_CONFIG,
+            "safety_settings": self.safety_settings
+        }
+    
+    def _batch_result(self, entry: Dict) -> Dict:
+        """
+        Convert one line of batch output into a classify_document-style result
+        """
+        try:
+            if "error" in entry:
+                raise Exception(entry["error"])
+            
+            candidate = entry["response"]["candidates"][0]
+            response_text = "".join(part.get("text", "") for part in candidate["content"]["parts"])
+            truncated = candidate.get("finishReason") == "MAX_TOKENS"
+            
+            return {
+                "success": True,
+                "classification": self._parse_json_response(response_text, truncated),
+                "raw_response": response_text
+            }
+        
+        except Exception as e:
+            error_message = f"Batch request failed: {e}"
+            return {
+                "success": False,
+                "error": error_message,
+                "classification": self._create_error_classification(error_message)
+            }
+    
+    def _parse_json_response(self, response_text: str, truncated: bool = False) -> Dict:
         """
         Parse JSON from response, handling markdown code blocks and other formats
+        truncated: The response hit the output token limit, so a cut-off
+        object may still hold usable leading fields
         """
         # Try direct JSON parse
         try:
-            return json.loads(response_text)
-        except json.JSONDecodeError:
+            return orjson.loads(response_text)
+        except orjson.JSONDecodeError:
             pass
         
-        # Try to extract JSON from markdown code blocks
-        json_patterns = [
-            r'```json\s*(\{.*?\})\s*```',  # ```json {...} ```
-            r'```\s*(\{.*?\})\s*```',       # ``` {...} ```
-            r'(\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\})'  # Any JSON object
-        ]
+        # Try the body of a markdown code block (```json ... ```)
+        body = strip_code_fence(response_text)
+        if body is not response_text:
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        
+        # Try every balanced {...} span in the text, in order
+        for candidate in find_json_objects(response_text):
+            try:
+                return orjson.loads(candidate)
+            except orjson.JSONDecodeError:
+                continue
         
-        for pattern in json_patterns:
-            matches = re.findall(pattern, response_text, re.DOTALL)
-            for match in matches:
-                try:
-                    return json.loads(match)
-                except json.JSONDecodeError:
-                    continue
+        if truncated:
+            salvaged = salvage_truncated_object(body)
+            if salvaged:
+                print(f"    ⚠️ Response was truncated, kept {len(salvaged)} complete fields")
+                return {
+                    **salvaged,
+                    "requires_human_review": True,
+                    "review_reason": "Response was truncated at the output token limit"
+                }
         
         # If we can't parse JSON, create a basic structure from the text
         print(f"    ⚠️ Could not parse JSON, creating structured response from text")
@@ -123,13 +412,12 @@ class GeminiService:
         Create a classification structure from plain text response
         """
         # Try to extract classification from text
-        classification = "Public"  # Default
-        if any(word in response_text.lower() for word in ["highly sensitive", "ssn", "social security", "classified"]):
-            classification = "Highly Sensitive"
-        elif any(word in response_text.lower() for word in ["confidential", "internal", "private"]):
-            classification = "Confidential"
-        elif any(word in response_text.lower() for word in ["unsafe", "inappropriate", "explicit"]):
-            classification = "Unsafe"
+        lower = response_text.lower()
+        classification = next(
+            (label for label, words in FALLBACK_CLASSIFICATION_KEYWORDS if any(word in lower for word in words)),
+            "Public"  # Default
+        )
+        unsafe = "unsafe" in lower
         
         return {
             "classification": classification,
@@ -143,16 +431,14 @@ class GeminiService:
                 "category_trigger": classification
             }],
             "pii_detected": {
-                "ssn": "ssn" in response_text.lower() or "social security" in response_text.lower(),
-                "credit_card": "credit card" in response_text.lower(),
-                "account_numbers": "account" in response_text.lower(),
+                **{pii: any(word in lower for word in words) for pii, words in FALLBACK_PII_KEYWORDS.items()},
                 "names": False,
                 "addresses": False,
                 "other": []
             },
             "safety_assessment": {
-                "is_safe": "unsafe" not in response_text.lower(),
-                "child_safe": "unsafe" not in response_text.lower(),
+                "is_safe": not unsafe,
+                "child_safe": not unsafe,
                 "issues": []
             },
             "recommendations": [],
@@ -186,4 +472,4 @@ class GeminiService:
             "recommendations": ["Retry classification", "Check API configuration"],
             "requires_human_review": True,
             "review_reason": f"API Error: {error_message}"
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,145 @@
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from google import genai
+import asyncio
+import httpx
+import time
+
+# Gemini daily quotas reset at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+# Seconds a key is benched after the API reports it rate limited
+RATE_LIMIT_COOLDOWN = 60
+
+# Per-key quotas of gemini-2.5-flash on paid tier 1
+DEFAULT_KEY_RPM = 1000
+DEFAULT_KEY_TPM = 1_000_000
+DEFAULT_KEY_RPD = 10_000
+
+# Idle connections each client keeps open (httpx defaults to 20 for 5 s), so
+# bursts of concurrent calls reuse warm TLS connections
+HTTP_CONNECTION_LIMITS = httpx.Limits(
+    max_connections=100, max_keepalive_connections=64, keepalive_expiry=30
+)
+
+# One client per API key for the whole process; each holds its own
+# connection pool, which every service using that key shares
+_clients: Dict[str, genai.Client] = {}
+
+def shared_client(api_key: str) -> genai.Client:
+    """The process-wide client for an API key, created on first use"""
+    client = _clients.get(api_key)
+    if client is None:
+        client = _clients[api_key] = genai.Client(
+            api_key=api_key,
+            http_options={"async_client_args": {"limits": HTTP_CONNECTION_LIMITS}}
+        )
+    return client
+
+async def close_shared_clients():
+    """Close every shared client's connection pools (at shutdown)"""
+    for client in _clients.values():
+        await client.aio.aclose()
+        client.close()
+    _clients.clear()
+
+class PooledKey:
+    """
+    One API key with its client and its quota usage: requests and tokens
+    over the last minute, and requests since the last daily reset
+    """
+    def __init__(self, index: int, api_key: str):
+        self.index = index
+        self.client = shared_client(api_key)
+        self.window: deque = deque()  # (timestamp, tokens) of recent requests
+        self.window_tokens = 0
+        self.day = _quota_day()
+        self.requests_today = 0
+        self.disabled_until = 0.0
+        
+        # sha256(prompt) -> (cached content name or None, renew after);
+        # cached content belongs to the key's project, so it is kept per key
+        self.prompt_caches: Dict[str, Tuple[Optional[str], float]] = {}
+        self.prompt_cache_lock = asyncio.Lock()
+    
+    def _expire(self, now: float):
+        """Forget requests older than a minute and roll over the day"""
+        while self.window and self.window[0][0] <= now - 60:
+            self.window_tokens -= self.window.popleft()[1]
+        
+        day = _quota_day()
+        if day != self.day:
+            self.day = day
+            self.requests_today = 0
+
+class GeminiKeyPool:
+    """
+    Spreads realtime Gemini calls over several API keys. Each key has its own
+    requests-per-minute, tokens-per-minute and requests-per-day budget; calls
+    go to the least-loaded key with room, and keys that hit a rate limit
+    anyway are benched for a cooldown
+    """
+    def __init__(self, api_keys: List[str], rpm: int = DEFAULT_KEY_RPM,
+                 tpm: int = DEFAULT_KEY_TPM, rpd: int = DEFAULT_KEY_RPD):
+        if not api_keys:
+            raise ValueError("At least one Gemini API key is required")
+        
+        self.keys = [PooledKey(i, api_key) for i, api_key in enumerate(api_keys)]
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+    
+    async def acquire(self, tokens: int) -> PooledKey:
+        """
+        Reserve one request of about this many tokens on a key, waiting until
+        some key has room
+        """
+        while True:
+            key, wait = self._try_acquire(tokens)
+            if key is not None:
+                return key
+            await asyncio.sleep(wait)
+    
+    def mark_rate_limited(self, key: PooledKey):
+        """Bench a key the API just throttled"""
+        key.disabled_until = time.monotonic() + RATE_LIMIT_COOLDOWN
+    
+    def _try_acquire(self, tokens: int) -> Tuple[Optional[PooledKey], float]:
+        """The chosen key, or None and how long to wait before trying again"""
+        now = time.monotonic()
+        best = None
+        wait = RATE_LIMIT_COOLDOWN
+        
+        for key in self.keys:
+            key._expire(now)
+            
+            if key.disabled_until > now:
+                wait = min(wait, key.disabled_until - now)
+                continue
+            
+            if key.requests_today >= self.rpd:
+                continue
+            
+            # A request larger than the whole TPM budget still goes through
+            # on an idle key rather than waiting forever
+            over_tpm = key.window and key.window_tokens + tokens > self.tpm
+            if len(key.window) >= self.rpm or over_tpm:
+                wait = min(wait, key.window[0][0] + 60 - now)
+                continue
+            
+            if best is None or len(key.window) < len(best.window):
+                best = key
+        
+        if best is None:
+            return None, max(wait, 0.05)
+        
+        best.window.append((now, tokens))
+        best.window_tokens += tokens
+        best.requests_today += 1
+        return best, 0.0
+
+def _quota_day():
+    """The current date in the timezone Gemini resets daily quotas in"""
+    return datetime.now(QUOTA_TIMEZONE).date()
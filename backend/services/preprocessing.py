@@ -1,16 +1,36 @@
-import fitz  # PyMuPDF
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 import io
-from typing import Dict, List, Tuple
-import cv2
-import numpy as np
+import os
+from typing import Dict, Iterator, List, Optional, Tuple, Union, BinaryIO
+
+# Rendered PDF pages are held as JPEG at this quality rather than raw RGB
+PAGE_JPEG_QUALITY = 85
+
+# Images sent to Gemini are JPEG no larger than this on the long edge; PNG
+# pages are several times bigger on the wire. JPEGs already within the limit
+# (rendered PDF pages, JPEG uploads) are sent as they are
+GEMINI_IMAGE_MAX_SIZE = 2048
+
+# MuPDF releases the GIL while rendering, so pages render in parallel on
+# threads shared by every document being preprocessed
+RENDER_WORKERS = os.cpu_count() or 4
+_render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="pdf-render")
+
+# Images larger than this on the long edge are downsampled before their
+# sharpness is measured; smaller ones are measured as they are
+QUALITY_SAMPLE_SIZE = 512
+# Laplacian variance that counts as fully sharp (unchanged from the
+# full-resolution measurement)
+QUALITY_VARIANCE_SCALE = 1000
 
 class PreprocessingService:
     
     @staticmethod
-    def extract_document_info(file_path: str, file_type: str) -> Dict:
+    def extract_document_info(file_path: Union[str, BinaryIO], file_type: str) -> Dict:
         """
         Extract basic information from document
+        file_path: Path on disk or a binary file object holding the document
         """
         if file_type == "pdf":
             return PreprocessingService._process_pdf(file_path)
@@ -20,66 +40,133 @@ class PreprocessingService:
             raise ValueError(f"Unsupported file type: {file_type}")
     
     @staticmethod
-    def _process_pdf(file_path: str) -> Dict:
+    def _process_pdf(file_path: Union[str, BinaryIO]) -> Dict:
         """
         Process PDF and extract metadata
         """
-        doc = fitz.open(file_path)
         pages_content = []
         images = []
         image_count = 0
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Extract text
-            text = page.get_text()
-            
-            # Check legibility (text density)
-            legibility_score = PreprocessingService._calculate_legibility(text, page)
-            
-            # Extract images from page
-            page_images = page.get_images()
-            image_count += len(page_images)
-            
-            # Convert page to image for multimodal analysis
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            
-            pages_content.append({
-                "page_number": page_num + 1,
-                "text": text,
-                "image": img,
-                "legibility_score": legibility_score,
-                "image_count": len(page_images)
-            })
-            
-            # Extract individual images
-            for img_index, img_info in enumerate(page_images):
-                xref = img_info[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                images.append({
-                    "page": page_num + 1,
-                    "index": img_index,
-                    "image": Image.open(io.BytesIO(image_bytes))
-                })
+        # Per-page fields the classifier reads, as parallel lists
+        page_numbers = []
+        page_texts = []
+        page_images = []
+        page_jpegs = []
+        
+        for page_info, embedded in PreprocessingService._iter_pdf_pages(file_path):
+            pages_content.append(page_info)
+            page_numbers.append(page_info["page_number"])
+            page_texts.append(page_info["text"])
+            page_images.append(page_info["image"])
+            page_jpegs.append(page_info["image_jpeg"])
+            image_count += page_info["image_count"]
+            images.extend(embedded)
         
         return {
-            "total_pages": len(doc),
+            "total_pages": len(pages_content),
             "total_images": image_count,
             "pages_content": pages_content,
+            "page_numbers": page_numbers,
+            "page_texts": page_texts,
+            "page_images": page_images,
+            "page_jpegs": page_jpegs,
             "extracted_images": images,
             "is_legible": all(p["legibility_score"] > 0.3 for p in pages_content)
         }
     
     @staticmethod
-    def _process_image(file_path: str) -> Dict:
+    def _iter_pdf_pages(file_path: Union[str, BinaryIO]) -> Iterator[Tuple[Dict, List[Dict]]]:
+        """
+        Yield (page info, embedded images) in page order. Pages are split into
+        contiguous runs rendered concurrently on the render pool, each worker
+        with its own fitz document since MuPDF documents aren't thread-safe
+        """
+        source = file_path.read() if hasattr(file_path, 'read') else file_path
+        with PreprocessingService._open_pdf(source) as doc:
+            page_count = len(doc)
+        
+        workers = min(RENDER_WORKERS, page_count)
+        if workers <= 1:
+            yield from PreprocessingService._render_pages(source, range(page_count))
+            return
+        
+        step = -(-page_count // workers)
+        runs = [range(first, min(first + step, page_count)) for first in range(0, page_count, step)]
+        for rendered in _render_pool.map(PreprocessingService._render_pages, [source] * len(runs), runs):
+            yield from rendered
+    
+    @staticmethod
+    def _open_pdf(source: Union[str, bytes]):
+        """Open a PDF from a path or its bytes"""
+        # Imported here so image-only workers never load MuPDF
+        import fitz  # PyMuPDF
+        
+        if isinstance(source, bytes):
+            return fitz.open(stream=source, filetype="pdf")
+        return fitz.open(source)
+    
+    @staticmethod
+    def _render_pages(source: Union[str, bytes], page_numbers: range) -> List[Tuple[Dict, List[Dict]]]:
+        """
+        Text, legibility, embedded images and a 2x render of each page in
+        page_numbers. Renders are kept only as JPEG bytes behind a lazily
+        decoded PIL image, and each pixmap is freed before the next
+        """
+        import fitz  # PyMuPDF
+        
+        rendered = []
+        with PreprocessingService._open_pdf(source) as doc:
+            for page_num in page_numbers:
+                page = doc[page_num]
+                
+                # Extract text
+                text = page.get_text()
+                
+                # Check legibility (text density)
+                legibility_score = PreprocessingService._calculate_legibility(text, page)
+                
+                # Extract images from page
+                embedded_images = page.get_images()
+                
+                # Convert page to image for multimodal analysis
+                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
+                jpeg = pix.tobytes("jpeg", jpg_quality=PAGE_JPEG_QUALITY)
+                img = Image.open(io.BytesIO(jpeg))
+                del pix
+                
+                # Extract individual images
+                embedded = []
+                for img_index, img_info in enumerate(embedded_images):
+                    xref = img_info[0]
+                    base_image = doc.extract_image(xref)
+                    image_bytes = base_image["image"]
+                    embedded.append({
+                        "page": page_num + 1,
+                        "index": img_index,
+                        "image": Image.open(io.BytesIO(image_bytes))
+                    })
+                
+                rendered.append(({
+                    "page_number": page_num + 1,
+                    "text": text,
+                    "image": img,
+                    "image_jpeg": jpeg,
+                    "legibility_score": legibility_score,
+                    "image_count": len(embedded_images)
+                }, embedded))
+        return rendered
+    
+    @staticmethod
+    def _process_image(file_path: Union[str, BinaryIO]) -> Dict:
         """
         Process single image
         """
         img = Image.open(file_path)
         
+        # JPEG uploads can go to Gemini as they are
+        jpeg = PreprocessingService._read_bytes(file_path) if img.format == "JPEG" else None
+        
         # Check image quality
         quality_score = PreprocessingService._calculate_image_quality(img)
         
@@ -93,6 +180,10 @@ class PreprocessingService:
                 "legibility_score": quality_score,
                 "image_count": 1
             }],
+            "page_numbers": [1],
+            "page_texts": [""],
+            "page_images": [img],
+            "page_jpegs": [jpeg],
             "extracted_images": [{
                 "page": 1,
                 "index": 0,
@@ -101,6 +192,38 @@ class PreprocessingService:
             "is_legible": quality_score > 0.3
         }
     
+    @staticmethod
+    def _read_bytes(file_path: Union[str, BinaryIO]) -> bytes:
+        """Whole content of a file on disk or of a binary file object"""
+        if hasattr(file_path, 'read'):
+            position = file_path.tell()
+            file_path.seek(0)
+            data = file_path.read()
+            file_path.seek(position)
+            return data
+        
+        with open(file_path, 'rb') as f:
+            return f.read()
+    
+    @staticmethod
+    def encode_for_gemini(img: Image.Image, jpeg: Optional[bytes] = None) -> Dict:
+        """
+        An image as a Gemini inline_data part: JPEG, downscaled to at most
+        GEMINI_IMAGE_MAX_SIZE on the long edge
+        jpeg: The JPEG file img was decoded from, if any; sent unchanged when
+        no resize is needed, sparing a decode, re-encode and generation loss
+        """
+        if jpeg is not None and max(img.size) <= GEMINI_IMAGE_MAX_SIZE and img.mode in ("RGB", "L"):
+            return {"inline_data": {"mime_type": "image/jpeg", "data": jpeg}}
+        
+        if max(img.size) > GEMINI_IMAGE_MAX_SIZE:
+            img = img.copy()
+            img.thumbnail((GEMINI_IMAGE_MAX_SIZE, GEMINI_IMAGE_MAX_SIZE), Image.BILINEAR)
+        
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, "JPEG", quality=PAGE_JPEG_QUALITY, optimize=True)
+        return {"inline_data": {"mime_type": "image/jpeg", "data": buffer.getvalue()}}
+    
     @staticmethod
     def _calculate_legibility(text: str, page) -> float:
         """
@@ -125,14 +248,24 @@ class PreprocessingService:
         """
         Calculate image quality score
         """
-        # Convert to numpy array
-        img_array = np.array(img)
+        # Imported here so PDF-only workers never load OpenCV
+        import cv2
+        import numpy as np
+        
+        # Sharpness only needs edge contrast, so large scans are measured on
+        # a copy area-averaged down to QUALITY_SAMPLE_SIZE on the long edge
+        # (bilinear softens text strokes more). Smaller images are never
+        # scaled up: interpolation would either blur the edges being measured
+        # or add staircase edges that look sharp
+        scale = QUALITY_SAMPLE_SIZE / max(img.size)
+        if scale < 1:
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BOX)
+        gray = np.asarray(img.convert("L"))
         
         # Calculate sharpness using Laplacian variance
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+        laplacian_var = float(cv2.Laplacian(gray, cv2.CV_32F).var())
         
         # Normalize score
-        quality_score = min(laplacian_var / 1000, 1.0)
+        quality_score = min(laplacian_var / QUALITY_VARIANCE_SCALE, 1.0)
         
         return quality_score
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from database.hitl_feedback import HITLDatabase
 
 class PromptEnhancementService:
@@ -7,40 +7,17 @@ class PromptEnhancementService:
     """
     def __init__(self, db: HITLDatabase):
         self.db = db
+        
+        # prompt_type -> (feedback version, enhancement block or "" if none);
+        # the insights only change when new feedback is saved
+        self._cache: Dict[str, Tuple[int, str]] = {}
     
     def get_enhancement_context(self) -> Dict:
         """
         Get context from learned patterns to enhance prompts
         """
         try:
-            insights = self.db.get_correction_insights()
-            
-            enhancement_context = {
-                'common_confusions': [],
-                'emphasis_needed': [],
-                'additional_examples': []
-            }
-            
-            # Identify common confusions
-            for correction in insights.get('common_corrections', []):
-                if correction['count'] >= 5:
-                    enhancement_context['common_confusions'].append({
-                        'from': correction['from'],
-                        'to': correction['to'],
-                        'guidance': self._generate_confusion_guidance(correction)
-                    })
-            
-            # Identify categories needing emphasis
-            for class_name, stats in insights.get('accuracy_by_class', {}).items():
-                accuracy = stats.get('accuracy', 100)  # Default to 100 if not present
-                if accuracy < 80:  # Less than 80% accuracy
-                    enhancement_context['emphasis_needed'].append({
-                        'category': class_name,
-                        'accuracy': accuracy,
-                        'guidance': self._generate_emphasis_guidance(class_name, stats)
-                    })
-            
-            return enhancement_context
+            return self._build_enhancement_context()
         
         except Exception as e:
             print(f"  ⚠️ Error getting enhancement context: {e}")
@@ -51,21 +28,52 @@ class PromptEnhancementService:
                 'additional_examples': []
             }
     
+    def _build_enhancement_context(self) -> Dict:
+        """Enhancement context from the current correction insights"""
+        insights = self.db.get_correction_insights()
+        
+        enhancement_context = {
+            'common_confusions': [],
+            'emphasis_needed': [],
+            'additional_examples': []
+        }
+        
+        # Identify common confusions
+        for correction in insights.get('common_corrections', []):
+            if correction['count'] >= 5:
+                enhancement_context['common_confusions'].append({
+                    'from': correction['from'],
+                    'to': correction['to'],
+                    'guidance': self._generate_confusion_guidance(correction)
+                })
+        
+        # Identify categories needing emphasis
+        for class_name, stats in insights.get('accuracy_by_class', {}).items():
+            accuracy = stats.get('accuracy', 100)  # Default to 100 if not present
+            if accuracy < 80:  # Less than 80% accuracy
+                enhancement_context['emphasis_needed'].append({
+                    'category': class_name,
+                    'accuracy': accuracy,
+                    'guidance': self._generate_emphasis_guidance(class_name, stats)
+                })
+        
+        return enhancement_context
+    
     def _generate_confusion_guidance(self, correction: Dict) -> str:
         """Generate guidance text for common confusions"""
         from_cat = correction['from']
         to_cat = correction['to']
         examples = correction.get('examples', [])
         
-        guidance = f"\n**IMPORTANT DISTINCTION:** Documents are often misclassified as '{from_cat}' when they should be '{to_cat}'.\n"
+        parts = [f"\n**IMPORTANT DISTINCTION:** Documents are often misclassified as '{from_cat}' when they should be '{to_cat}'.\n"]
         
         if examples:
-            guidance += f"Common indicators for '{to_cat}':\n"
+            parts.append(f"Common indicators for '{to_cat}':\n")
             for example in examples[:2]:
                 if example and example.strip():
-                    guidance += f"- {example.strip()}\n"
+                    parts.append(f"- {example.strip()}\n")
         
-        return guidance
+        return "".join(parts)
     
     def _generate_emphasis_guidance(self, category: str, stats: Dict) -> str:
         """Generate emphasis guidance for problematic categories"""
@@ -81,42 +89,56 @@ class PromptEnhancementService:
         Enhance a prompt with learned context
         """
         try:
-            context = self.get_enhancement_context()
+            enhancement = self._get_enhancement(prompt_type)
             
             # If no enhancements needed, return original
-            if not context['common_confusions'] and not context['emphasis_needed']:
-                print("  ℹ️ No learned patterns to apply yet")
+            if not enhancement:
                 return base_prompt
             
-            enhancement = "\n\n--- 🧠 LEARNED FROM HUMAN FEEDBACK ---\n"
+            # Insert enhancement after the initial instruction but before
+            # examples, or append to end if no clear insertion point
+            head, sep, tail = base_prompt.partition("**Response Format")
+            return head + enhancement + sep + tail
+        
+        except Exception as e:
+            print(f"  ⚠️ Error enhancing prompt: {e}")
+            import traceback
+            traceback.print_exc()
+            # Return original prompt if enhancement fails
+            return base_prompt
+    
+    def _get_enhancement(self, prompt_type: str) -> str:
+        """
+        Enhancement block for prompt_type, rebuilt only after new feedback
+        has been saved since it was last built
+        """
+        version = self.db.get_feedback_version()
+        cached = self._cache.get(prompt_type)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        
+        context = self._build_enhancement_context()
+        
+        if not context['common_confusions'] and not context['emphasis_needed']:
+            print("  ℹ️ No learned patterns to apply yet")
+            enhancement = ""
+        else:
+            parts = ["\n\n--- 🧠 LEARNED FROM HUMAN FEEDBACK ---\n"]
             
             # Add confusion warnings
             if context['common_confusions']:
-                enhancement += "\n🎯 COMMON MISTAKES TO AVOID:\n"
-                for confusion in context['common_confusions']:
-                    enhancement += confusion['guidance']
+                parts.append("\n🎯 COMMON MISTAKES TO AVOID:\n")
+                parts.extend(confusion['guidance'] for confusion in context['common_confusions'])
             
             # Add emphasis areas
             if context['emphasis_needed']:
-                enhancement += "\n⚠️ CATEGORIES REQUIRING EXTRA CARE:\n"
-                for emphasis in context['emphasis_needed']:
-                    enhancement += emphasis['guidance']
+                parts.append("\n⚠️ CATEGORIES REQUIRING EXTRA CARE:\n")
+                parts.extend(emphasis['guidance'] for emphasis in context['emphasis_needed'])
             
-            enhancement += "\n--- END LEARNED CONTEXT ---\n\n"
+            parts.append("\n--- END LEARNED CONTEXT ---\n\n")
+            enhancement = "".join(parts)
             
             print(f"  ✓ Applied {len(context['common_confusions'])} confusion patterns and {len(context['emphasis_needed'])} emphasis areas")
-            
-            # Insert enhancement after the initial instruction but before examples
-            if "**Response Format" in base_prompt:
-                parts = base_prompt.split("**Response Format")
-                return parts[0] + enhancement + "**Response Format" + parts[1]
-            else:
-                # Append to end if no clear insertion point
-                return base_prompt + enhancement
         
-        except Exception as e:
-            print(f"  ⚠️ Error enhancing prompt: {e}")
-            import traceback
-            traceback.print_exc()
-            # Return original prompt if enhancement fails
-            return base_prompt
\ No newline at end of file
+        self._cache[prompt_type] = (version, enhancement)
+        return enhancement
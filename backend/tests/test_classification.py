@@ -0,0 +1,76 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+pytest.importorskip("google.genai")
+pytest.importorskip("cv2")
+
+from database.hitl_feedback import HITLDatabase
+from services.classification import ClassificationService
+
+class FakeGemini:
+    """Answers batched classification prompts with one result block per document"""
+    
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.classify_calls = []
+    
+    async def classify_document(self, content, prompt, cacheable=False):
+        self.classify_calls.append(prompt)
+        docs = [item for item in content if isinstance(item, str) and item.startswith("<<DOC ")]
+        if not docs:
+            return {"success": True, "classification": {"classification": "Public", "confidence": 0.95}}
+        
+        blocks = []
+        for marker in docs:
+            i = int(marker[len("<<DOC "):-2])
+            if i not in self.missing:
+                blocks.append(f'<<RESULT {i}>>\n{{"classification": "Confidential", "confidence": 0.95}}\n<<END>>')
+        return {"success": True, "raw_response": "\n".join(blocks)}
+    
+    async def safety_check(self, prompt, content, cacheable=False):
+        return {"success": True, "classification": {"is_safe": True}}
+
+def _scan(label: str) -> io.BytesIO:
+    img = Image.new("RGB", (400, 300), "white")
+    draw = ImageDraw.Draw(img)
+    for y in range(4, 280, 14):
+        draw.text((4, y), f"{label} - salary details - INTERNAL ONLY", fill="black")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    buf.seek(0)
+    return buf
+
+@pytest.fixture
+def service(tmp_path):
+    service = ClassificationService("test-key", enable_dual_verification=False,
+                                    db=HITLDatabase(str(tmp_path / "hitl.db")))
+    service.gemini_primary = FakeGemini()
+    return service
+
+def test_batch_classifies_every_document_in_one_call(service):
+    results = asyncio.run(service.classify_documents_batch(
+        [(_scan("a"), "png"), (_scan("b"), "png"), (_scan("c"), "png")]
+    ))
+    
+    assert [r["classification"] for r in results] == ["Confidential"] * 3
+    assert len(service.gemini_primary.classify_calls) == 1
+
+def test_batch_falls_back_for_missing_results(service):
+    service.gemini_primary.missing = {1}
+    
+    results = asyncio.run(service.classify_documents_batch([(_scan("a"), "png"), (_scan("b"), "png")]))
+    
+    assert [r["classification"] for r in results] == ["Confidential", "Public"]
+    assert len(service.gemini_primary.classify_calls) == 2
+
+def test_batch_reuses_stored_results(service):
+    files = [(_scan("a"), "png"), (_scan("b"), "png")]
+    asyncio.run(service.classify_documents_batch(files))
+    
+    results = asyncio.run(service.classify_documents_batch(files))
+    
+    assert all(r["cached"] for r in results)
+    assert len(service.gemini_primary.classify_calls) == 1
@@ -0,0 +1,41 @@
+import io
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("cryptography")
+pytest.importorskip("orjson")
+
+from cryptography.fernet import Fernet
+
+from services.file_storage import THUMBNAIL_SIZE, SecureFileStorage
+
+def _png(width: int = 800, height: int = 600) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buf, format="PNG")
+    return buf.getvalue()
+
+@pytest.mark.parametrize("classification", ["Public", "Highly Sensitive"])
+def test_thumbnail_is_rendered_from_stored_file(tmp_path, classification):
+    storage = SecureFileStorage(str(tmp_path), Fernet.generate_key().decode())
+    
+    result = storage.store_stream(io.BytesIO(_png()), "scan.png", classification, {})
+    metadata = storage.get_file_metadata(result['file_id'])
+    
+    # Thumbnails render in the background; close() waits for them
+    storage.close()
+    
+    assert metadata['encrypted'] == (classification == "Highly Sensitive")
+    with Image.open(metadata['thumbnail_path']) as thumb:
+        assert max(thumb.size) == THUMBNAIL_SIZE
+
+def test_thumbnail_pool_starts_on_first_thumbnail(tmp_path):
+    storage = SecureFileStorage(str(tmp_path), Fernet.generate_key().decode())
+    assert storage._thumb_pool is None
+    
+    storage.store_stream(io.BytesIO(b"plain text"), "notes.txt", "Public", {})
+    assert storage._thumb_pool is None
+    
+    storage.store_stream(io.BytesIO(_png()), "scan.png", "Public", {})
+    assert storage._thumb_pool is not None
+    storage.close()
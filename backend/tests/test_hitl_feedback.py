@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip("orjson")
+pytest.importorskip("cachetools")
+
+from database.hitl_feedback import HITLDatabase
+
+@pytest.fixture
+def db(tmp_path):
+    return HITLDatabase(str(tmp_path / "hitl.db"))
+
+def test_audit_flusher_writes_every_queued_entry(db):
+    async def run():
+        db.start_audit_flusher()
+        uids = [await db.enqueue_audit({'document_name': f'doc{i}', 'classification': 'Public'})
+                for i in range(300)]
+        await db.stop_audit_flusher()
+        return uids
+    
+    uids = asyncio.run(run())
+    
+    assert {row['audit_uid'] for row in db.get_audit_trail(limit=1000)} == set(uids)
+
+def test_audit_flusher_falls_back_to_single_rows(db, monkeypatch):
+    def failing_bulk(entries):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(db, 'save_audit_logs_bulk', failing_bulk)
+    
+    async def run():
+        db.start_audit_flusher()
+        uid = await db.enqueue_audit({'document_name': 'doc', 'classification': 'Public'})
+        await db.stop_audit_flusher()
+        return uid
+    
+    uid = asyncio.run(run())
+    
+    # Feedback on the returned uid resolves to the row written by the fallback
+    db.save_feedback({'document_id': uid, 'original_classification': 'Public',
+                      'corrected_classification': 'Public'})
+    assert db.is_document_reviewed(db.get_audit_trail()[0]['id'])
+
+def test_batch_progress_updates_without_results(db):
+    db.save_batch_job('job', {'status': 'processing', 'total': 3, 'completed': 0,
+                              'results': [], 'started_at': '2024-01-01T00:00:00'})
+    
+    db.update_batch_progress('job', 2)
+    db.update_batch_progress('job', 1)
+    
+    assert db.get_batch_status('job')['completed'] == 2
+    assert db.get_batch_job('job')['results'] == []
+
+def test_duplicate_patterns_are_merged_before_unique_index(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE learned_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pattern_type TEXT NOT NULL,
+            from_classification TEXT,
+            to_classification TEXT,
+            frequency INTEGER DEFAULT 1,
+            keywords TEXT,
+            context TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_seen DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany('''
+        INSERT INTO learned_patterns
+        (pattern_type, from_classification, to_classification, frequency, context)
+        VALUES ('misclassification', ?, ?, ?, ?)
+    ''', [('Public', 'Confidential', 2, 'salary table'),
+          ('Public', 'Confidential', 1, 'bank details'),
+          ('Public', 'Highly Sensitive', 1, 'ssn')])
+    conn.commit()
+    conn.close()
+    
+    db = HITLDatabase(path)
+    
+    rows = {(p['from_classification'], p['to_classification']): p
+            for p in db.get_learned_patterns()}
+    assert len(rows) == 2
+    assert rows[('Public', 'Confidential')]['frequency'] == 3
+    assert rows[('Public', 'Confidential')]['context'] == 'salary table | bank details'
+    
+    # The upsert now bumps the merged row instead of adding another
+    db.save_feedback({'document_id': '1', 'original_classification': 'Public',
+                      'corrected_classification': 'Confidential'})
+    assert len(db.get_learned_patterns()) == 2
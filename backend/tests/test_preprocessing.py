@@ -0,0 +1,83 @@
+import io
+from typing import Dict
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from services.preprocessing import QUALITY_SAMPLE_SIZE, PreprocessingService
+
+def _text_image(width: int, height: int) -> Image.Image:
+    """Black text lines on white, like a small clean scan"""
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    for y in range(4, height - 12, 14):
+        draw.text((4, y), "Quarterly report 2024 - INTERNAL ONLY - page 1 of 3", fill="black")
+    return img
+
+def _screenshot_image(width: int, height: int) -> Image.Image:
+    """Coloured buttons and form labels on a flat background, like a UI screenshot"""
+    img = Image.new("RGB", (width, height), (230, 230, 240))
+    draw = ImageDraw.Draw(img)
+    for i, color in enumerate([(40, 90, 200), (200, 60, 60), (60, 160, 80)]):
+        x = 8 + i * width // 3
+        draw.rectangle([x, 4, x + width // 4, 22], fill=color)
+    for y in range(32, height - 12, 20):
+        draw.text((4, y), "Name:  Jane Doe     Account:  Savings", fill="black")
+    return img
+
+def _full_resolution_score(img: Image.Image) -> float:
+    """Sharpness score measured on the whole image, as before sampling"""
+    gray = cv2.cvtColor(np.array(img.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    return min(cv2.Laplacian(gray, cv2.CV_64F).var() / 1000, 1.0)
+
+def _quality(img: Image.Image) -> Dict:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    buf.seek(0)
+    return PreprocessingService.extract_document_info(buf, "png")
+
+SMALL_SIZES = [(128, 96), (256, 192), (400, 300), (QUALITY_SAMPLE_SIZE, 384)]
+
+@pytest.mark.parametrize("make_image", [_text_image, _screenshot_image])
+@pytest.mark.parametrize("size", SMALL_SIZES)
+def test_sharp_small_image_is_legible(make_image, size):
+    info = _quality(make_image(*size))
+    
+    assert info["is_legible"]
+    assert info["pages_content"][0]["legibility_score"] > 0.3
+
+@pytest.mark.parametrize("make_image", [_text_image, _screenshot_image])
+@pytest.mark.parametrize("size", SMALL_SIZES)
+def test_blurred_small_image_is_not_legible(make_image, size):
+    info = _quality(make_image(*size).filter(ImageFilter.GaussianBlur(2)))
+    
+    assert not info["is_legible"]
+
+@pytest.mark.parametrize("make_image", [_text_image, _screenshot_image])
+@pytest.mark.parametrize("size", SMALL_SIZES)
+@pytest.mark.parametrize("blur", [0, 1, 2])
+def test_small_image_scores_match_full_resolution(make_image, size, blur):
+    img = make_image(*size)
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    
+    score = PreprocessingService._calculate_image_quality(img)
+    
+    assert score == pytest.approx(_full_resolution_score(img), abs=1e-3)
+
+LARGE_SIZES = [(1024, 768), (2480, 3508)]
+
+@pytest.mark.parametrize("make_image", [_text_image, _screenshot_image])
+@pytest.mark.parametrize("size", LARGE_SIZES)
+def test_sharp_large_scan_is_legible(make_image, size):
+    assert _quality(make_image(*size))["is_legible"]
+
+@pytest.mark.parametrize("make_image", [_text_image, _screenshot_image])
+@pytest.mark.parametrize("size", LARGE_SIZES)
+def test_blurred_large_scan_is_not_legible(make_image, size):
+    info = _quality(make_image(*size).filter(ImageFilter.GaussianBlur(5)))
+    
+    assert not info["is_legible"]
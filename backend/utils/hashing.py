@@ -0,0 +1,82 @@
+import functools
+import hashlib
+import io
+import mmap
+import os
+import stat
+from typing import BinaryIO, Optional, Union
+
+CHUNK_SIZE = 1 << 20
+
+@functools.lru_cache(maxsize=64)
+def text_sha256(text: str) -> str:
+    """
+    SHA-256 hex digest of a string's UTF-8 encoding. Remembered for the last
+    few strings, as the same prompts are hashed for every document
+    """
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def file_sha256(source: Union[str, BinaryIO]) -> str:
+    """
+    SHA-256 hex digest of a file on disk or of a binary file object.
+    File objects are read from the start and rewound afterwards.
+    """
+    if hasattr(source, 'read'):
+        source.seek(0)
+        digest = _digest(source)
+        source.seek(0)
+        return digest
+    
+    with open(source, 'rb') as f:
+        return _digest(f)
+
+def _digest(f: BinaryIO) -> str:
+    """Hash a binary file object from its current position"""
+    # Files on disk are mapped and hashed in one update call, with no
+    # copies through a read buffer
+    digest = _mmap_digest(f)
+    if digest is not None:
+        return digest
+    
+    # file_digest runs the read/update loop in C (and hashes BytesIO buffers
+    # without copying); it is only available from Python 3.11
+    if hasattr(hashlib, 'file_digest'):
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+    
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _mmap_digest(f: BinaryIO) -> Optional[str]:
+    """
+    Hash a file on disk through a read-only memory map, so hashlib walks the
+    mapped pages in C. Returns None for anything but a regular file object
+    """
+    # Only real files: asking a SpooledTemporaryFile for its fileno would
+    # roll it over to disk
+    if not isinstance(f, (io.FileIO, io.BufferedReader, io.BufferedRandom)):
+        return None
+    
+    try:
+        fileno = f.fileno()
+        file_stat = os.fstat(fileno)
+    except OSError:
+        return None
+    
+    # Pipes and devices can't be mapped
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+    
+    size = file_stat.st_size
+    
+    start = f.tell()
+    sha256 = hashlib.sha256()
+    
+    # Empty files can't be mapped
+    if size > start:
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mm:
+            sha256.update(memoryview(mm)[start:])
+        f.seek(size)
+    
+    return sha256.hexdigest()
@@ -0,0 +1,79 @@
+import json
+from typing import Dict, Iterator, Optional
+
+# Reused to parse truncated responses one field at a time
+_JSON_DECODER = json.JSONDecoder()
+
+def strip_code_fence(text: str) -> str:
+    """Body of a text wrapped in a markdown code fence, else text itself"""
+    stripped = text.strip()
+    if not stripped.startswith("```"):
+        return text
+    
+    # Drop the opening fence line (with its language tag) and the closing fence
+    newline = stripped.find("\n")
+    if newline == -1:
+        return text
+    end = stripped.rfind("```")
+    return stripped[newline + 1:end if end > newline else len(stripped)]
+
+def salvage_truncated_object(text: str) -> Optional[Dict]:
+    """
+    The top-level key/value pairs of a JSON object that were complete before
+    the text was cut off, or None if there are none
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    
+    salvaged = {}
+    pos = start + 1
+    while True:
+        try:
+            pos = _skip_json_separators(text, pos, " \t\r\n,")
+            key, pos = _JSON_DECODER.raw_decode(text, pos)
+            pos = _skip_json_separators(text, pos, " \t\r\n")
+            if not isinstance(key, str) or text[pos] != ":":
+                break
+            value, pos = _JSON_DECODER.raw_decode(text, _skip_json_separators(text, pos + 1, " \t\r\n"))
+        except (json.JSONDecodeError, IndexError):
+            break
+        salvaged[key] = value
+    
+    return salvaged or None
+
+def _skip_json_separators(text: str, pos: int, separators: str) -> int:
+    """Index of the first character at or after pos not in separators"""
+    while pos < len(text) and text[pos] in separators:
+        pos += 1
+    return pos
+
+def find_json_objects(text: str) -> Iterator[str]:
+    """
+    Top-level {...} spans of text in one linear pass, tracking nesting depth
+    and skipping braces inside JSON strings
+    """
+    depth = 0
+    start = 0
+    in_string = False
+    escape = False
+    
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            # Quotes outside any object are prose, not JSON strings
+            in_string = depth > 0
+        elif char == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield text[start:i + 1]
@@ -0,0 +1,54 @@
+import hashlib
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from cachetools import LRUCache
+from PIL import Image
+from utils.hashing import text_sha256
+import orjson
+
+# Set for the duration of a call that must reach the API, e.g. an explicit
+# re-classification; tasks started inside inherit it
+bypass_llm_cache: ContextVar[bool] = ContextVar("bypass_llm_cache", default=False)
+
+class LLMCache:
+    """
+    Exact-match cache of Gemini results keyed by a fingerprint of the model,
+    prompt, content and generation settings. Kept in memory; subclasses can
+    override get/set to share entries through an external store.
+    """
+    def __init__(self, maxsize: int = 1024):
+        self._cache = LRUCache(maxsize=maxsize)
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Cached result for a key, as a fresh copy, or None"""
+        data = self._cache.get(key)
+        return orjson.loads(data) if data is not None else None
+    
+    def set(self, key: str, result: Dict):
+        """Store a result; it is serialized so later mutation can't leak in"""
+        self._cache[key] = orjson.dumps(result, default=str)
+    
+    @staticmethod
+    def make_key(model: str, prompt: str, content: List[Any], config: Dict) -> str:
+        """
+        SHA-256 over the request. Inline image parts (the stored page JPEGs)
+        are hashed by their encoded bytes, without decoding them; PIL images
+        by mode, size and pixels. The prompt is hashed by its memoized
+        digest, so it is not re-encoded for every document
+        """
+        sha256 = hashlib.sha256(orjson.dumps(
+            {"model": model, "prompt": text_sha256(prompt), "config": config},
+            option=orjson.OPT_SORT_KEYS
+        ))
+        for part in content:
+            if isinstance(part, dict) and "inline_data" in part:
+                blob = part["inline_data"]
+                sha256.update(f"\0blob:{blob['mime_type']}:{len(blob['data'])}\0".encode())
+                sha256.update(blob["data"])
+            elif isinstance(part, Image.Image):
+                sha256.update(f"\0image:{part.mode}:{part.size}\0".encode())
+                sha256.update(part.tobytes())
+            else:
+                sha256.update(b"\0text\0")
+                sha256.update(str(part).encode())
+        return sha256.hexdigest()
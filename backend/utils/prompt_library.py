@@ -1,295 +1,206 @@
-import json
+import dataclasses
+import functools
+import logging
 import os
 import re
-from typing import Dict, List
-
-class PromptLibrary:
-    def __init__(self, config_path: str = None, db=None):
-        if config_path is None:
-            # Default path relative to this file
-            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            config_path = os.path.join(base_dir, "config", "prompt_library.json")
+import sys
+import orjson
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+try:
+    import re2  # google-re2
+except ImportError:  # optional; fall back to one re search per pattern
+    re2 = None
+
+try:
+    import ahocorasick  # pyahocorasick
+except ImportError:  # optional; fall back to one substring check per keyword
+    ahocorasick = None
+
+# Per-document prompt choices; silent unless debug logging is enabled
+_log = logging.getLogger(__name__)
+
+# Numeric shapes of potential PII looked for by perform_initial_scan
+PII_PATTERNS = (
+    ('ssn', r'\d{3}-\d{2}-\d{4}'),
+    ('credit_card', r'\d{4}[\s-]?\d{4}[\s-]?\d{4}[\s-]?\d{4}'),
+    ('account_number', r'\d{9,}'),  # 9+ digits
+)
+
+# Every PII pattern needs at least this many ASCII digits; text with fewer
+# (most prose) skips the pattern scan entirely
+PII_MIN_DIGITS = 9
+ASCII_DIGITS = '0123456789'
+
+def _compile_pii_scanner():
+    """
+    Function returning the names of the PII_PATTERNS present in a text. With
+    RE2 all patterns are matched as one set in a single linear-time scan of
+    compiled code, so a hand-written byte loop (e.g. JIT-compiled) would not
+    beat it and would have to copy the patterns' semantics
+    """
+    if re2 is not None:
+        pattern_set = re2.Set.SearchSet(re2.Options())
+        for _, pattern in PII_PATTERNS:
+            pattern_set.Add(pattern)
+        pattern_set.Compile()
         
-        with open(config_path, 'r') as f:
-            self.prompts = json.load(f)
+        def match(text: str) -> Set[str]:
+            return {PII_PATTERNS[i][0] for i in pattern_set.Match(text) or ()}
+    else:
+        # ASCII \d and \s, as in RE2
+        compiled = [(name, re.compile(pattern, re.ASCII)) for name, pattern in PII_PATTERNS]
         
-        # Initialize enhancement service if database provided
-        self.db = db
-        if db:
-            from services.prompt_enhancement import PromptEnhancementService
-            self.enhancer = PromptEnhancementService(db)
-        else:
-            self.enhancer = None
+        def match(text: str) -> Set[str]:
+            return {name for name, pattern in compiled if pattern.search(text)}
     
-    def perform_initial_scan(self, doc_info: Dict) -> Dict:
-        """
-        Perform quick initial scan to determine document characteristics
-        This helps choose the right specialized prompt
-        """
-        scan_result = {
-            'contains_numbers': False,
-            'has_ssn_pattern': False,
-            'has_credit_card_pattern': False,
-            'is_internal': False,
-            'has_confidential_markers': False,
-            'has_violent_indicators': False,
-            'is_marketing': False,
-            'has_technical_content': False,
-            'word_count': 0,
-            'image_count': doc_info.get('total_images', 0)
-        }
-        
-        # Combine all text from document
-        all_text = ""
-        for page in doc_info.get('pages_content', []):
-            if page.get('text'):
-                all_text += page['text'] + " "
-        
-        all_text_lower = all_text.lower()
-        scan_result['word_count'] = len(all_text.split())
-        
-        # Check for numeric patterns (potential PII)
-        if re.search(r'\d{3}-\d{2}-\d{4}', all_text):  # SSN pattern
-            scan_result['has_ssn_pattern'] = True
-            scan_result['contains_numbers'] = True
-        
-        if re.search(r'\d{4}[\s-]?\d{4}[\s-]?\d{4}[\s-]?\d{4}', all_text):  # Credit card
-            scan_result['has_credit_card_pattern'] = True
-            scan_result['contains_numbers'] = True
-        
-        if re.search(r'\d{9,}', all_text):  # Account numbers (9+ digits)
-            scan_result['contains_numbers'] = True
-        
-        # Check for internal/confidential markers
-        internal_keywords = [
-            'internal only', 'confidential', 'proprietary', 'do not distribute',
-            'internal memo', 'company confidential', 'restricted', 'for internal use'
-        ]
-        for keyword in internal_keywords:
-            if keyword in all_text_lower:
-                scan_result['is_internal'] = True
-                scan_result['has_confidential_markers'] = True
-                break
-        
-        # Check for marketing indicators
-        marketing_keywords = [
-            'brochure', 'marketing', 'promotional', 'advertisement', 'sale',
-            'visit our website', 'contact us', 'learn more', 'special offer'
-        ]
-        marketing_count = sum(1 for kw in marketing_keywords if kw in all_text_lower)
-        if marketing_count >= 2:
-            scan_result['is_marketing'] = True
-        
-        # Check for violent/unsafe indicators (for safety routing)
-        violent_keywords = [
-            'weapon', 'gun', 'rifle', 'military', 'combat', 'battlefield',
-            'violence', 'assault', 'attack', 'warfare'
-        ]
-        violent_count = sum(1 for kw in violent_keywords if kw in all_text_lower)
-        if violent_count >= 2:
-            scan_result['has_violent_indicators'] = True
-        
-        # Check for technical/schematic content
-        technical_keywords = [
-            'specification', 'schematic', 'blueprint', 'technical drawing',
-            'patent', 'design document', 'engineering'
-        ]
-        for keyword in technical_keywords:
-            if keyword in all_text_lower:
-                scan_result['has_technical_content'] = True
-                break
-        
-        return scan_result
+    def scan(text: str) -> Set[str]:
+        # str.count runs in C, so ten counts cost far less than a regex scan
+        if sum(map(text.count, ASCII_DIGITS)) < PII_MIN_DIGITS:
+            return set()
+        return match(text)
     
-    def get_dynamic_prompt_tree(self, initial_scan_result: Dict = None) -> str:
-        """
-        Generate dynamic prompt based on initial document scan
-        WITH HITL-learned enhancements
-        """
-        # Get base prompt based on scan
-        base_prompt = self._get_base_prompt_for_scan(initial_scan_result)
-        
-        # Enhance with learned patterns from HITL feedback
-        if self.enhancer:
-            print(" Enhancing prompt with learned patterns...")
-            base_prompt = self.enhancer.enhance_prompt(base_prompt, 'classification')
-        
-        return base_prompt
-    
-    def _get_base_prompt_for_scan(self, initial_scan_result: Dict = None) -> str:
-        """Get base prompt based on scan results"""
-        if not initial_scan_result:
-            return self.get_classification_prompt()
-        
-        # Decision tree logic
-        # Priority 1: SSN or Credit Card detected → PII-focused
-        if initial_scan_result.get('has_ssn_pattern') or initial_scan_result.get('has_credit_card_pattern'):
-            print(" Dynamic Prompt: Using PII-focused prompt (SSN/CC detected)")
-            return self._get_pii_focused_prompt()
-        
-        # Priority 2: Numbers detected → Broader PII check
-        if initial_scan_result.get('contains_numbers'):
-            print(" Dynamic Prompt: Using PII-focused prompt (numbers detected)")
-            return self._get_pii_focused_prompt()
-        
-        # Priority 3: Internal/Confidential markers → Confidential-focused
-        if initial_scan_result.get('is_internal') or initial_scan_result.get('has_confidential_markers'):
-            print(" Dynamic Prompt: Using Confidential-focused prompt")
-            return self._get_confidential_focused_prompt()
-        
-        # Priority 4: Technical content → Technical classification
-        if initial_scan_result.get('has_technical_content'):
-            print(" Dynamic Prompt: Using Technical/Proprietary-focused prompt")
-            return self._get_technical_focused_prompt()
-        
-        # Priority 5: Marketing indicators → Public-focused
-        if initial_scan_result.get('is_marketing'):
-            print(" Dynamic Prompt: Using Public/Marketing-focused prompt")
-            return self._get_public_focused_prompt()
-        
-        # Priority 6: Violent indicators → Safety-aware classification
-        if initial_scan_result.get('has_violent_indicators'):
-            print(" Dynamic Prompt: Using Safety-aware classification prompt")
-            return self._get_safety_aware_prompt()
-        
-        # Default: Use standard classification prompt
-        print(" Dynamic Prompt: Using standard classification prompt")
-        return self.get_classification_prompt()
-    
-    def _get_pii_focused_prompt(self) -> str:
-        """Specialized prompt for documents with potential PII"""
-        base = """
-You are a PII detection expert analyzing a document that may contain Personal Identifiable Information.
-
-**PRIMARY OBJECTIVE:** Identify and classify based on PII presence.
-
-**PII Detection Checklist:**
-1. **Social Security Numbers (SSN):** Format XXX-XX-XXXX or 9 consecutive digits
-2. **Credit Card Numbers:** 16 digits, may have spaces or dashes
-3. **Bank Account Numbers:** 8-17 digits
-4. **Driver's License Numbers:** Various formats
-5. **Dates of Birth:** Any DOB in context of a person
-6. **Medical Record Numbers:** Any healthcare identifiers
-7. **Passport Numbers:** Various formats
-8. **Personal Addresses:** Full residential addresses
-9. **Phone Numbers:** With personal context
-
-**Classification Decision:**
-- **IF ANY of the above PII is found** → "Highly Sensitive"
-- **IF only names/addresses without SSN/financial data** → "Confidential"
-- **IF no PII at all** → Evaluate as normal document
+    return scan
 
-**CRITICAL:** Even ONE instance of SSN, credit card, or account number makes the entire document "Highly Sensitive"
+_scan_pii = _compile_pii_scanner()
 
-**Response Format (JSON):**
-{
-    "classification": "Highly Sensitive" | "Confidential" | "Public",
-    "confidence": 0.95,
-    "primary_reason": "Found Social Security Number on page X",
-    "detailed_reasoning": "Document contains PII including SSN which classifies it as Highly Sensitive",
-    "evidence": [{
-        "page": 1,
-        "location": "Middle section",
-        "finding": "SSN: XXX-XX-XXXX detected",
-        "category_trigger": "Highly Sensitive - PII (SSN)"
-    }],
-    "pii_detected": {
-        "ssn": true,
-        "credit_card": false,
-        "account_numbers": false,
-        "names": true,
-        "addresses": true,
-        "other": []
-    },
-    "recommendations": ["Redact all PII", "Restrict access"],
-    "requires_human_review": false,
-    "review_reason": ""
+def _count_words(text: str) -> int:
+    """
+    len(text.split()) without building the word list: counts the bytes that
+    start a word. Only ASCII whitespace separates words here
+    """
+    import numpy as np
+    
+    data = np.frombuffer(text.encode('utf-8', 'surrogatepass'), dtype=np.uint8)
+    if not data.size:
+        return 0
+    
+    # Space, \t-\r and the \x1c-\x1f separators, as str.split
+    is_space = (data == 32) | ((data >= 9) & (data <= 13)) | ((data >= 28) & (data <= 31))
+    return int(np.count_nonzero(is_space[:-1] & ~is_space[1:])) + (not is_space[0])
+
+# Keywords perform_initial_scan looks for in the lowercased text, by category
+SCAN_KEYWORDS = {
+    # Internal/confidential markers
+    'internal': (
+        'internal only', 'confidential', 'proprietary', 'do not distribute',
+        'internal memo', 'company confidential', 'restricted', 'for internal use'
+    ),
+    # Marketing indicators
+    'marketing': (
+        'brochure', 'marketing', 'promotional', 'advertisement', 'sale',
+        'visit our website', 'contact us', 'learn more', 'special offer'
+    ),
+    # Violent/unsafe indicators (for safety routing)
+    'violent': (
+        'weapon', 'gun', 'rifle', 'military', 'combat', 'battlefield',
+        'violence', 'assault', 'attack', 'warfare'
+    ),
+    # Technical/schematic content
+    'technical': (
+        'specification', 'schematic', 'blueprint', 'technical drawing',
+        'patent', 'design document', 'engineering'
+    ),
 }
 
-Analyze and respond ONLY with JSON:
-"""
-        return self._apply_learned_enhancements(base, "PII")
+# perform_initial_scan needs at most this many keyword hits per category
+KEYWORD_HIT_LIMIT = 2
+
+def _compile_keyword_scanner():
+    """
+    Function returning the distinct SCAN_KEYWORDS present in a lowercased
+    text as (category, keyword) pairs. With pyahocorasick every keyword is
+    found in a single pass over the text; without it, each category stops
+    being searched after KEYWORD_HIT_LIMIT hits. The substring checks run in
+    C and are ~10x faster than walking a keyword trie in Python
+    """
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for category, keywords in SCAN_KEYWORDS.items():
+            for keyword in keywords:
+                automaton.add_word(keyword, (category, keyword))
+        automaton.make_automaton()
+        
+        def scan(text: str) -> Set[Tuple[str, str]]:
+            return {hit for _, hit in automaton.iter(text)}
+    else:
+        def scan(text: str) -> Set[Tuple[str, str]]:
+            found = set()
+            for category, keywords in SCAN_KEYWORDS.items():
+                hits = 0
+                for keyword in keywords:
+                    if keyword in text:
+                        found.add((category, keyword))
+                        hits += 1
+                        if hits >= KEYWORD_HIT_LIMIT:
+                            break
+            return found
     
-    def _get_confidential_focused_prompt(self) -> str:
-        """Specialized prompt for internal/confidential documents"""
-        base = """
-You are analyzing a document that appears to be INTERNAL or CONFIDENTIAL.
-
-**Classification Logic:**
-
-**Highly Sensitive**: Contains PII, proprietary tech, classified info, trade secrets
-**Confidential**: Internal memos, business strategy, customer lists, operational docs
-**Public**: Only if meant for external distribution despite labels
-
-Analyze and respond with JSON format showing classification, evidence, and reasoning.
-"""
-        return self._apply_learned_enhancements(base, "Confidential")
+    return scan
+
+_scan_keywords = _compile_keyword_scanner()
+
+# Scan flags in the order _get_base_prompt_for_scan gives them priority; bit i
+# of a scan's priority mask is set when any flag of entry i is, and the bit
+# after the last is always set for the standard prompt
+SCAN_PRIORITY_FLAGS = (
+    ('has_ssn_pattern', 'has_credit_card_pattern'),
+    ('contains_numbers',),
+    ('is_internal', 'has_confidential_markers'),
+    ('has_technical_content',),
+    ('is_marketing',),
+    ('has_violent_indicators',),
+)
+
+def _scan_priority_mask(scan_result: Union['ScanResult', Dict]) -> int:
+    """Priority mask of a scan result, see SCAN_PRIORITY_FLAGS"""
+    mask = 1 << len(SCAN_PRIORITY_FLAGS)
+    for bit, flags in enumerate(SCAN_PRIORITY_FLAGS):
+        if any(scan_result.get(flag) for flag in flags):
+            mask |= 1 << bit
+    return mask
+
+@dataclasses.dataclass(slots=True)
+class ScanResult:
+    """
+    Document characteristics found by PromptLibrary.perform_initial_scan.
+    Also readable with .get like the plain dict it replaces
+    """
+    contains_numbers: bool = False
+    has_ssn_pattern: bool = False
+    has_credit_card_pattern: bool = False
+    is_internal: bool = False
+    has_confidential_markers: bool = False
+    has_violent_indicators: bool = False
+    is_marketing: bool = False
+    has_technical_content: bool = False
+    word_count: int = 0
+    image_count: int = 0
+    priority_mask: int = 1 << len(SCAN_PRIORITY_FLAGS)
     
-    def _get_technical_focused_prompt(self) -> str:
-        """Specialized prompt for technical documents"""
-        return """
-You are analyzing a TECHNICAL document for proprietary content.
-
-**Highly Sensitive**: Defense specs, proprietary formulas, trade secrets, patent-pending
-**Confidential**: Internal technical docs, SOPs, non-proprietary engineering
-**Public**: Published papers, customer specs, open-source docs
-
-Respond with JSON classification.
-"""
+    def get(self, field: str, default: Any = None) -> Any:
+        return getattr(self, field, default)
     
-    def _get_public_focused_prompt(self) -> str:
-        """Specialized prompt for public documents"""
-        return """
-You are verifying a PUBLIC/MARKETING document.
+    def as_dict(self) -> Dict:
+        return dataclasses.asdict(self)
 
-**Confirm Public IF**: Marketing material, public contact info, no confidential markers
-**Reclassify Confidential IF**: Draft restrictions, internal pricing, customer analytics
-**Reclassify Highly Sensitive IF**: Any PII found
+# Default config path, relative to this file
+DEFAULT_CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "prompt_library.json"
+)
 
-Respond with JSON classification.
-"""
-    
-    def _get_safety_aware_prompt(self) -> str:
-        """Specialized prompt for military/defense content"""
-        return """
-You are analyzing MILITARY/WEAPONS/DEFENSE content.
-
-**Highly Sensitive**: Classified specs, active weapons systems, restricted tech
-**Confidential**: Internal defense docs, non-classified equipment info
-**Public**: Declassified historical docs, published military history
+@functools.lru_cache(maxsize=8)
+def _load_config(config_path: str) -> Dict:
+    """Parsed prompt library config, read once per path per process"""
+    with open(config_path, 'rb') as f:
+        return orjson.loads(f.read())
 
-Note: Safety is evaluated separately. Focus on SENSITIVITY.
+# Prompt texts are interned, so every call hands out the same string object
+# and comparing or hashing them is cheap
 
-Respond with JSON classification.
-"""
-    
-    def _apply_learned_enhancements(self, base_prompt: str, category: str) -> str:
-        """Apply learned enhancements from HITL feedback"""
-        if not self.db:
-            return base_prompt
-        
-        try:
-            patterns = self.db.get_learned_patterns()
-            
-            # Filter patterns relevant to this category
-            relevant_patterns = [p for p in patterns if p['from_classification'] == category and p['frequency'] >= 3]
-            
-            if relevant_patterns:
-                enhancement = "\n\n--- LEARNED FROM HUMAN CORRECTIONS ---\n"
-                for pattern in relevant_patterns[:3]:  # Top 3 patterns
-                    enhancement += f"COMMON MISTAKE: Documents are often incorrectly classified as '{pattern['from_classification']}' when they should be '{pattern['to_classification']}'\n"
-                    enhancement += f"   Occurred {pattern['frequency']} times. Context: {pattern['context'][:150]}...\n\n"
-                enhancement += "--- END LEARNED PATTERNS ---\n\n"
-                
-                return base_prompt + enhancement
-        except Exception as e:
-            print(f"Warning: Could not apply learned enhancements: {e}")
-        
-        return base_prompt
-    
-    def get_classification_prompt(self, page_content: str = None) -> str:
-        """Standard classification prompt with enhancements"""
-        base_prompt = """
+# Standard classification prompt, before learned enhancements
+CLASSIFICATION_PROMPT = sys.intern("""
 You are an expert document classifier for regulatory compliance. Analyze the provided document and classify it into ONE of these categories based on SENSITIVITY LEVEL:
 
 **Categories (Choose ONE):**
@@ -365,17 +276,10 @@ Example 3 - Internal Memo:
 - Reasoning: "Marked as internal only, contains business strategy"
 
 Now analyze the document and respond ONLY with the JSON format above:
-"""
-        
-        # Enhance with learned patterns
-        if self.enhancer:
-            base_prompt = self.enhancer.enhance_prompt(base_prompt, 'classification')
-        
-        return base_prompt
-    
-    def _get_pii_focused_prompt(self) -> str:
-        """Specialized prompt for documents with potential PII"""
-        base = """
+""")
+
+# Specialized prompt for documents with potential PII
+PII_FOCUSED_PROMPT = sys.intern("""
 You are a PII detection expert analyzing a document that may contain Personal Identifiable Information.
 
 **PRIMARY OBJECTIVE:** Identify and classify based on PII presence.
@@ -425,12 +329,10 @@ You are a PII detection expert analyzing a document that may contain Personal Id
 
 **SCAN CAREFULLY:** Check every page, every number sequence, every form field.
 Analyze the document now and respond ONLY with JSON:
-"""
-        return self._apply_learned_enhancements(base, "Highly Sensitive")
-    
-    def _get_confidential_focused_prompt(self) -> str:
-        """Specialized prompt for internal/confidential documents"""
-        base = """
+""")
+
+# Specialized prompt for internal/confidential documents
+CONFIDENTIAL_FOCUSED_PROMPT = sys.intern("""
 You are analyzing a document that appears to be INTERNAL or CONFIDENTIAL.
 
 **PRIMARY OBJECTIVE:** Determine the appropriate confidentiality level.
@@ -483,12 +385,10 @@ You are analyzing a document that appears to be INTERNAL or CONFIDENTIAL.
 }
 
 Analyze and respond ONLY with JSON:
-"""
-        return self._apply_learned_enhancements(base, "Confidential")
-    
-    def _get_technical_focused_prompt(self) -> str:
-        """Specialized prompt for technical documents"""
-        base = """
+""")
+
+# Specialized prompt for technical documents
+TECHNICAL_FOCUSED_PROMPT = sys.intern("""
 You are analyzing a TECHNICAL document for proprietary content.
 
 **Highly Sensitive**: Defense specs, proprietary formulas, trade secrets, patent-pending
@@ -496,12 +396,10 @@ You are analyzing a TECHNICAL document for proprietary content.
 **Public**: Published papers, customer specs, open-source docs
 
 Respond with JSON classification including evidence and reasoning.
-"""
-        return self._apply_learned_enhancements(base, "Technical")
-    
-    def _get_public_focused_prompt(self) -> str:
-        """Specialized prompt for public documents"""
-        base = """
+""")
+
+# Specialized prompt for public documents
+PUBLIC_FOCUSED_PROMPT = sys.intern("""
 You are verifying a PUBLIC/MARKETING document.
 
 **Confirm Public IF**: Marketing material, public contact info, no confidential markers
@@ -509,12 +407,10 @@ You are verifying a PUBLIC/MARKETING document.
 **Reclassify Highly Sensitive IF**: Any PII found
 
 Respond with JSON classification.
-"""
-        return self._apply_learned_enhancements(base, "Public")
-    
-    def _get_safety_aware_prompt(self) -> str:
-        """Specialized prompt for military/defense content"""
-        return """
+""")
+
+# Specialized prompt for military/defense content
+SAFETY_AWARE_PROMPT = sys.intern("""
 You are analyzing MILITARY/WEAPONS/DEFENSE content for SENSITIVITY (not safety).
 
 **Highly Sensitive**: Classified specs, active weapons systems, restricted tech
@@ -524,50 +420,10 @@ You are analyzing MILITARY/WEAPONS/DEFENSE content for SENSITIVITY (not safety).
 Note: Safety is evaluated separately. Focus on SENSITIVITY level.
 
 Respond with JSON classification.
-"""
-    
-    def _apply_learned_enhancements(self, base_prompt: str, category: str) -> str:
-        """Apply learned enhancements from HITL feedback"""
-        if not self.db:
-            return base_prompt
-        
-        try:
-            patterns = self.db.get_learned_patterns()
-            
-            # Filter patterns relevant to this category
-            relevant_patterns = [
-                p for p in patterns 
-                if (p['from_classification'] == category or p['to_classification'] == category) 
-                and p['frequency'] >= 3
-            ]
-            
-            if relevant_patterns:
-                enhancement = "\n\n--- LEARNED FROM HUMAN CORRECTIONS ---\n"
-                enhancement += "The following patterns have been identified from expert feedback:\n\n"
-                
-                for pattern in relevant_patterns[:3]:  # Top 3 patterns
-                    enhancement += f"COMMON MISTAKE #{pattern['frequency']}:\n"
-                    enhancement += f"   '{pattern['from_classification']}' is often confused with '{pattern['to_classification']}'\n"
-                    
-                    if pattern.get('context'):
-                        contexts = pattern['context'].split(' | ')
-                        if contexts:
-                            enhancement += f"   Expert feedback: {contexts[0][:150]}\n"
-                    
-                    enhancement += f"   → Be extra careful distinguishing these categories!\n\n"
-                
-                enhancement += "--- END LEARNED PATTERNS ---\n\n"
-                
-                print(f"  Applied {len(relevant_patterns)} learned patterns to prompt")
-                return base_prompt + enhancement
-        except Exception as e:
-            print(f"  Could not apply learned enhancements: {e}")
-        
-        return base_prompt
-    
-    def get_safety_check_prompt(self) -> str:
-        """Dedicated safety check prompt"""
-        return """
+""")
+
+# Dedicated safety check prompt
+SAFETY_CHECK_PROMPT = sys.intern("""
 You are a content safety expert analyzing this document for harmful content that would make it UNSAFE.
 
 **CRITICAL INSTRUCTION:** Be VERY STRICT in identifying unsafe content. When in doubt about violence, explicit content, or child safety, mark as UNSAFE.
@@ -646,7 +502,224 @@ If UNSAFE:
 - Is this disturbing or graphic? → If YES, mark UNSAFE
 
 Analyze the document. Be STRICT. Respond ONLY with JSON:
-"""
+""")
+
+class PromptLibrary:
+    def __init__(self, config_path: str = None, db=None):
+        # Shared between instances, so treat it as read-only
+        self.prompts = _load_config(config_path or DEFAULT_CONFIG_PATH)
+        
+        # Enhancement service is created on first use if database provided
+        self.db = db
+        self.enhancer = None
+        
+        # category -> (feedback version, base prompt, prompt with learned patterns)
+        self._enhanced_cache: Dict[str, Tuple[int, str, str]] = {}
+        
+        # (database feedback version, category -> frequent learned patterns
+        # involving it), shared by every category's prompt
+        self._patterns_cache: Optional[Tuple[int, Dict[str, List[Dict]]]] = None
+        
+        # Prompt for each priority mask bit, highest priority first
+        self._priority_handlers = (
+            (self._get_pii_focused_prompt, "Dynamic Prompt: Using PII-focused prompt (SSN/CC detected)"),
+            (self._get_pii_focused_prompt, "Dynamic Prompt: Using PII-focused prompt (numbers detected)"),
+            (self._get_confidential_focused_prompt, "Dynamic Prompt: Using Confidential-focused prompt"),
+            (self._get_technical_focused_prompt, "Dynamic Prompt: Using Technical/Proprietary-focused prompt"),
+            (self._get_public_focused_prompt, "Dynamic Prompt: Using Public/Marketing-focused prompt"),
+            (self._get_safety_aware_prompt, "Dynamic Prompt: Using Safety-aware classification prompt"),
+            (self.get_classification_prompt, "Dynamic Prompt: Using standard classification prompt"),
+        )
+    
+    def perform_initial_scan(self, doc_info: Dict) -> ScanResult:
+        """
+        Perform quick initial scan to determine document characteristics
+        This helps choose the right specialized prompt. An SSN or credit card
+        number already decides the prompt, so the keyword flags are left
+        False when one is found
+        """
+        scan_result = ScanResult(image_count=doc_info.get('total_images', 0))
+        
+        # Combine all text from document
+        all_text = " ".join(page['text'] for page in doc_info.get('pages_content', ()) if page.get('text'))
+        
+        scan_result.word_count = _count_words(all_text)
+        
+        # Check for numeric patterns (potential PII)
+        pii_found = _scan_pii(all_text)
+        scan_result.has_ssn_pattern = 'ssn' in pii_found
+        scan_result.has_credit_card_pattern = 'credit_card' in pii_found
+        scan_result.contains_numbers = bool(pii_found)
+        
+        # PII-focused prompt regardless of keywords: skip the keyword pass
+        if scan_result.has_ssn_pattern or scan_result.has_credit_card_pattern:
+            scan_result.priority_mask = _scan_priority_mask(scan_result)
+            return scan_result
+        
+        # For ASCII text (the usual case) str.lower() takes CPython's ASCII
+        # fast path, a single C loop over the buffer, so it stays a str that
+        # the keyword automaton can scan directly. It also beats str.translate
+        # with an ASCII-only table, by 1.6x on ASCII and ~10x on mixed text
+        all_text_lower = all_text.lower()
+        
+        # Count distinct keywords found per category (thresholds stay within
+        # KEYWORD_HIT_LIMIT)
+        keyword_counts = Counter(category for category, _ in _scan_keywords(all_text_lower))
+        
+        scan_result.is_internal = keyword_counts['internal'] > 0
+        scan_result.has_confidential_markers = keyword_counts['internal'] > 0
+        scan_result.is_marketing = keyword_counts['marketing'] >= 2
+        scan_result.has_violent_indicators = keyword_counts['violent'] >= 2
+        scan_result.has_technical_content = keyword_counts['technical'] > 0
+        scan_result.priority_mask = _scan_priority_mask(scan_result)
+        
+        return scan_result
+    
+    def get_dynamic_prompt_tree(self, initial_scan_result: Union[ScanResult, Dict] = None) -> str:
+        """
+        Generate dynamic prompt based on initial document scan
+        WITH HITL-learned enhancements
+        """
+        # Get base prompt based on scan
+        base_prompt = self._get_base_prompt_for_scan(initial_scan_result)
+        
+        # Enhance with learned patterns from HITL feedback
+        enhancer = self._get_enhancer()
+        if enhancer:
+            _log.debug("Enhancing prompt with learned patterns...")
+            base_prompt = enhancer.enhance_prompt(base_prompt, 'classification')
+        
+        return base_prompt
+    
+    def _get_base_prompt_for_scan(self, initial_scan_result: Union[ScanResult, Dict] = None) -> str:
+        """Get base prompt based on scan results"""
+        if not initial_scan_result:
+            return self.get_classification_prompt()
+        
+        # Scans from perform_initial_scan carry their mask; dicts of flags
+        # are encoded here. The lowest set bit picks the prompt
+        if isinstance(initial_scan_result, ScanResult):
+            mask = initial_scan_result.priority_mask
+        else:
+            mask = initial_scan_result.get('priority_mask')
+            if mask is None:
+                mask = _scan_priority_mask(initial_scan_result)
+        
+        handler, message = self._priority_handlers[(mask & -mask).bit_length() - 1]
+        _log.debug(message)
+        return handler()
+    
+    def get_classification_prompt(self, page_content: str = None) -> str:
+        """Standard classification prompt with enhancements"""
+        base_prompt = CLASSIFICATION_PROMPT
+        
+        # Enhance with learned patterns
+        enhancer = self._get_enhancer()
+        if enhancer:
+            base_prompt = enhancer.enhance_prompt(base_prompt, 'classification')
+        
+        return base_prompt
+    
+    def _get_enhancer(self):
+        """
+        The PromptEnhancementService for the database, or None without one.
+        Imported and created on first use; a concurrent first call may build
+        a second one, which is harmless as it only caches derived prompts
+        """
+        if self.enhancer is None and self.db:
+            from services.prompt_enhancement import PromptEnhancementService
+            self.enhancer = PromptEnhancementService(self.db)
+        return self.enhancer
+    
+    def _get_pii_focused_prompt(self) -> str:
+        """Specialized prompt for documents with potential PII"""
+        return self._apply_learned_enhancements(PII_FOCUSED_PROMPT, "Highly Sensitive")
+    
+    def _get_confidential_focused_prompt(self) -> str:
+        """Specialized prompt for internal/confidential documents"""
+        return self._apply_learned_enhancements(CONFIDENTIAL_FOCUSED_PROMPT, "Confidential")
+    
+    def _get_technical_focused_prompt(self) -> str:
+        """Specialized prompt for technical documents"""
+        return self._apply_learned_enhancements(TECHNICAL_FOCUSED_PROMPT, "Technical")
+    
+    def _get_public_focused_prompt(self) -> str:
+        """Specialized prompt for public documents"""
+        return self._apply_learned_enhancements(PUBLIC_FOCUSED_PROMPT, "Public")
+    
+    def _get_safety_aware_prompt(self) -> str:
+        """Specialized prompt for military/defense content"""
+        return SAFETY_AWARE_PROMPT
+    
+    def _apply_learned_enhancements(self, base_prompt: str, category: str) -> str:
+        """Apply learned enhancements from HITL feedback"""
+        if not self.db:
+            return base_prompt
+        
+        try:
+            # Patterns only change when feedback is saved, through any worker,
+            # so reuse the enhanced prompt until the feedback version stored in
+            # the database moves on
+            version = self.db.get_feedback_version()
+            cached = self._enhanced_cache.get(category)
+            if cached is not None and cached[0] == version and cached[1] == base_prompt:
+                return cached[2]
+            
+            relevant_patterns = self._get_patterns_by_category(version).get(category, [])
+            
+            if relevant_patterns:
+                enhancement = "\n\n--- LEARNED FROM HUMAN CORRECTIONS ---\n"
+                enhancement += "The following patterns have been identified from expert feedback:\n\n"
+                
+                for pattern in relevant_patterns[:3]:  # Top 3 patterns
+                    enhancement += f"COMMON MISTAKE #{pattern['frequency']}:\n"
+                    enhancement += f"   '{pattern['from_classification']}' is often confused with '{pattern['to_classification']}'\n"
+                    
+                    if pattern.get('context'):
+                        contexts = pattern['context'].split(' | ')
+                        if contexts:
+                            enhancement += f"   Expert feedback: {contexts[0][:150]}\n"
+                    
+                    enhancement += f"   → Be extra careful distinguishing these categories!\n\n"
+                
+                enhancement += "--- END LEARNED PATTERNS ---\n\n"
+                
+                _log.debug("Applied %d learned patterns to prompt", len(relevant_patterns))
+                enhanced = base_prompt + enhancement
+            else:
+                enhanced = base_prompt
+        except Exception as e:
+            print(f"  Could not apply learned enhancements: {e}")
+            return base_prompt
+        
+        self._enhanced_cache[category] = (version, base_prompt, enhanced)
+        return enhanced
+    
+    def _get_patterns_by_category(self, version: int) -> Dict[str, List[Dict]]:
+        """
+        Learned patterns seen at least 3 times, under both their from and to
+        classification, fetched once per feedback version for all categories.
+        version comes from the database, so feedback saved by another worker
+        also triggers a refetch; it is read before the patterns, so a save in
+        between only causes one extra refetch, never stale patterns
+        """
+        if self._patterns_cache is not None and self._patterns_cache[0] == version:
+            return self._patterns_cache[1]
+        
+        by_category = defaultdict(list)
+        for pattern in self.db.get_learned_patterns():
+            if pattern['frequency'] < 3:
+                continue
+            by_category[pattern['from_classification']].append(pattern)
+            if pattern['to_classification'] != pattern['from_classification']:
+                by_category[pattern['to_classification']].append(pattern)
+        
+        self._patterns_cache = (version, dict(by_category))
+        return self._patterns_cache[1]
+    
+    def get_safety_check_prompt(self) -> str:
+        """Dedicated safety check prompt"""
+        return SAFETY_CHECK_PROMPT
     
     def get_dual_verification_prompt(self, first_result: Dict) -> str:
         """Second LLM verification prompt"""
@@ -665,7 +738,7 @@ You are a secondary reviewer verifying a document classification.
    - Is it public marketing material? → Public
 
 **Previous Analysis:**
-{json.dumps(first_result, indent=2)}
+{orjson.dumps(first_result, option=orjson.OPT_INDENT_2).decode()}
 
 **Response Format (MUST be valid JSON):**
 {{